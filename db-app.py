@@ -19,10 +19,15 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
+import sqlite3
 import sys
-import tkinter as tk
+from contextlib import redirect_stdout
+from lib.cli import COMMANDS, run_command
 from lib.db import Database
+from lib.export import WRITERS
 from lib.seed import seed_database
+from lib.source import find_seed_file, get_cleaners
+from lib.trace import enable_tracing
 
 ################################################################################
 ### TODO: add an option to specify column names on the command-line, when using a seed file.
@@ -34,25 +39,89 @@ class AppInterface():
     def __init__(self):
         """Start with generic values, to be updated from command-line args."""
         self.seed = False
+        self.sample = None
+        self.jobs = '1'
+        self.key = None
+        self.clean = None
+        self.cleaners = []
         self.title = 'Database Control Interface'
         self.db_path = '%s/data' % \
                 (os.path.dirname(p=os.path.abspath(path=__file__)))
         self.db_name = None
+        self.table = None
+        self.command = None
+        self.format = 'csv'
+        self.trace = False
+        self.serve = None
+        self.fields = {}
 
     def parse_args(self, args):
         """
         Parse command-line arguments and set instance variables for the app.
         """
+        """The command to run in place of the user-interface window, if any."""
+        if args and args[0] in COMMANDS:
+            self.command = args.pop(0)
         while args:
             """Show the help message text for the app."""
             if args[0] == '-h' or args[0] == '--help':
                 self.show_usage(status=0)
             """Flags a requirement to populate the database with some initial
-            seed data. Seed data will be read from the file '<db_name>.csv'."""
+            seed data. Seed data will be read from the file '<db_name>.csv', or
+            another of the seed files that find_seed_file() looks for."""
             if args[0] == '-s' or args[0] == '--seed':
                 self.seed = True
                 args.pop(0)
                 continue
+            """The count of seed records from which to infer the column data
+            types. All of the seed records are inspected, by default."""
+            if args[0] == '-n' or args[0] == '--sample':
+                args.pop(0)
+                if args:
+                    self.sample = args[0]
+                    args.pop(0)
+                continue
+            """The count of processes that parse the seed file in parallel."""
+            if args[0] == '-j' or args[0] == '--jobs':
+                args.pop(0)
+                if args:
+                    self.jobs = args[0]
+                    args.pop(0)
+                continue
+            """Flags that database statements are to be timed and tallied."""
+            if args[0] == '-x' or args[0] == '--trace':
+                self.trace = True
+                args.pop(0)
+                continue
+            """The natural key columns by which an existing database is
+            refreshed from its seed file, rather than rebuilt."""
+            if args[0] == '-k' or args[0] == '--key':
+                args.pop(0)
+                if args:
+                    self.key = args[0].split(',')
+                    args.pop(0)
+                continue
+            """The cleaners that the seed records are passed through."""
+            if args[0] == '-c' or args[0] == '--clean':
+                args.pop(0)
+                if args:
+                    self.clean = args[0]
+                    args.pop(0)
+                continue
+            """The address on which to serve the database's tables."""
+            if args[0] == '-S' or args[0] == '--serve':
+                args.pop(0)
+                if args:
+                    self.serve = args[0]
+                    args.pop(0)
+                continue
+            """The output format of a command's records."""
+            if args[0] == '-f' or args[0] == '--format':
+                args.pop(0)
+                if args:
+                    self.format = args[0]
+                    args.pop(0)
+                continue
             """The title text for the user-interface window."""
             if args[0] == '-t' or args[0] == '--title':
                 args.pop(0)
@@ -60,6 +129,13 @@ class AppInterface():
                     self.title = args[0]
                     args.pop(0)
                 continue
+            """The table to open, when not the one named after the database."""
+            if args[0] == '-T' or args[0] == '--table':
+                args.pop(0)
+                if args:
+                    self.table = args[0]
+                    args.pop(0)
+                continue
             """The directory path to the database or seed file."""
             if args[0] == '-p' or args[0] == '--path':
                 args.pop(0)
@@ -72,6 +148,10 @@ class AppInterface():
             if not self.db_name:
                 self.db_name = args[0]
                 args.pop(0)
+            elif self.command and '=' in args[0]:
+                """A COLUMN=VALUE field for the command."""
+                key, value = args.pop(0).split('=', 1)
+                self.fields[key] = value
             else:
                 """The current arg didn't parse as a valid option, and db_name
                 has already been parsed above, so the current arg is invalid."""
@@ -80,7 +160,8 @@ class AppInterface():
         if self.db_path[0] == '.':
             self.db_path = '%s/%s' % (os.getcwd(), self.db_path)
         db_file = os.path.normpath('%s/%s.db' % (self.db_path, self.db_name))
-        seed_file = os.path.normpath('%s/%s.csv' % (self.db_path, self.db_name))
+        seed_file = find_seed_file(self.db_path, self.db_name) or \
+                os.path.normpath('%s/%s.csv' % (self.db_path, self.db_name))
         if not self.db_name:
             msg = '**Error: %s' % ('database name not specified')
             self.show_usage(msg)
@@ -93,6 +174,37 @@ class AppInterface():
         if not self.seed and not os.path.isfile(db_file):
             msg = '**Error: %s, "%s"' % ('database file not found', db_file)
             self.show_usage(msg)
+        if self.sample is not None:
+            if not self.sample.isdigit() or not int(self.sample):
+                msg = '**Error: %s, "%s"' % ('invalid sample count',
+                                             self.sample)
+                self.show_usage(msg)
+            self.sample = int(self.sample)
+        if not self.jobs.isdigit() or not int(self.jobs):
+            msg = '**Error: %s, "%s"' % ('invalid jobs count', self.jobs)
+            self.show_usage(msg)
+        self.jobs = int(self.jobs)
+        if self.key is not None and (not self.seed or not all(self.key)):
+            msg = '**Error: %s, "%s"' % ('invalid seed key', ','.join(self.key))
+            self.show_usage(msg)
+        if self.clean is not None:
+            try:
+                self.cleaners = get_cleaners(self.clean)
+            except ValueError:
+                self.cleaners = None
+            if not self.seed or not self.cleaners:
+                msg = '**Error: %s, "%s"' % ('invalid cleaners', self.clean)
+                self.show_usage(msg)
+        if self.serve is not None:
+            host, port = self.serve.rpartition(':')[::2]
+            if not port.isdigit() or int(port) > 65535 or self.command:
+                msg = '**Error: %s, "%s"' % ('invalid serve address',
+                                             self.serve)
+                self.show_usage(msg)
+            self.serve = (host, int(port))
+        if self.format not in WRITERS:
+            msg = '**Error: %s, "%s"' % ('unknown format', self.format)
+            self.show_usage(msg)
 
     def show_usage(self, status):
         """
@@ -100,219 +212,167 @@ class AppInterface():
         """
         script = os.path.basename(__file__)     # script = sys.argv[0][sys.argv[0].rfind('/')+1:]
         print("""
-Usage: %s [--seed] [--title TITLE] [--path DIRECTORY] DB_NAME
+Usage: %s [--seed [--sample COUNT] [--jobs COUNT] [--key COLUMNS] [--clean CLEANERS]] [--title TITLE] [--table TABLE] [--path DIRECTORY] [--trace] DB_NAME
+       %s COMMAND [--seed [--sample COUNT] [--jobs COUNT] [--key COLUMNS] [--clean CLEANERS]] [--format FORMAT] [--table TABLE] [--path DIRECTORY] [--trace] DB_NAME [COLUMN=VALUE ...]
+       %s --serve [HOST:]PORT [--seed [--sample COUNT] [--jobs COUNT] [--key COLUMNS] [--clean CLEANERS]] [--path DIRECTORY] [--trace] DB_NAME
        %s --help
 
    Options:
         -s | --seed             Initialize a fresh database from seed data.
+        -n | --sample COUNT     Infer column types from COUNT seed records.
+        -j | --jobs COUNT       Parse the seed file with COUNT processes.
+        -k | --key COLUMNS      Refresh the database by natural key COLUMNS.
+        -c | --clean CLEANERS   Clean the seed records with CLEANERS.
         -t | --title TITLE      Specify a TITLE for the GUI window.
+        -T | --table TABLE      Open the database's TABLE, not table DB_NAME.
         -p | --path DIRECTORY   Specify a DIRECTORY for the database file.
+        -f | --format FORMAT    Write COMMAND records as csv, json or columnar.
+        -S | --serve ADDRESS    Serve the database as HTTP/JSON on ADDRESS.
+        -x | --trace            Time and tally the database statements run.
         -h | --help             Print this message text.
 
+   Commands:
+        query                   Write the records that match COLUMN=VALUE.
+        insert                  Add a record of COLUMN=VALUE fields.
+        update                  Change COLUMN=VALUE fields of record id=ID.
+        delete                  Delete the record id=ID.
+        export                  Write every record in the table.
+
     This app displays a database-control interface for an Sqlite database named
     <DB_NAME>. That database's file name will be '<DB_NAME>.db'. The database
     file location defaults to the application sub-directory named 'data'. The
-    non-extensive user interface is able to administer a database that contains
-    just one table, and that table's name duplicates the database's name.
-    i.e. Table 'books' in database 'books.db'.
+    non-extensive user interface administers one table at a time, which is at
+    first the table whose name duplicates the database's name, i.e. Table 'books'
+    in database 'books.db'. Another of the database's tables may be opened with
+    the '--table' option, or switched to from the window's table menu.
+
+    In the window, several records may be selected with Shift- or Control-
+    clicks, or every record with Control-A, and then updated or deleted
+    together. Edits are held, and may be undone, until they are saved, which
+    is done by the Save or Close button, on closing the window, or 30 seconds
+    after the first held edit. Searches see the held edits. While edits are
+    held, the database is locked against other writers, which wait up to 5
+    seconds for the edits to be saved, and then fail.
 
     When the '--seed' option is specified, then the database-table's column
     names, as well as the table's contents, are generated from the comma-
     seperated file which corresponds to <DB_NAME> with a filename extension
     '.csv' appended, i.e. '<DB_NAME>.csv'. When using seed data from such a
     file, the database file will be created within the same directory as where
-    the seed file is located.
+    the seed file is located. Failing a '.csv' file, the seed file may instead
+    be named with a '.tsv', '.psv', '.txt', '.jsonl' or '.ndjson' extension,
+    and any seed file may be compressed, with '.gz', '.bz2' or '.xz' appended
+    to its name. It is decompressed as it is read.
 
     When the '--path' option is specified, then <DIRECTORY> is used in place of
     the default directiory as the location for the database file and (when used)
     the seed file.
 
-    When the '--title' option is specified, then <TITLE> is displayed as the
-    database-control interface's window title.
-
-    When using seed data, the seed file's contents should consist of newline-
-    seperated data records. In addition, the database-table's column data will
-    correspond to the comma-seperated fields within each line of the seed file.
-    The first line in the seed file will specify the database-table's column
-    names, also comma-seperated.
-        """ % (script, script))
-        sys.exit(status)
-
-################################################################################
-class UserInterface():
-    """
-    UserInterface creates and places Tk form elements according to the caller's
-    specification. These elements consists of a flexible count of entry elements
-    with associated label elements, a listbox element with scrollbar attached,
-    and buttons that interface with whichever database is associated with the
-    caller.
-    """
-    def __init__(self, window, fields, buttons):
-        self.fields = fields
-        self.window = window
-        self.lbl = {}
-        self.ent = {}
-        self.btn = {}
-        self.lst = None
-        self.selected = None
-        self.col = 0
-        self.row = 0
-        """Add the data-entry fields, a listbox with scrollbar, and the buttons
-        to the user interface."""
-        for field in fields:
-            self.add_field(name=field, field_break=2)
-        self.add_list()
-        for i in range(len(buttons)):
-            self.add_button(name=buttons[i][0], command=buttons[i][1])
-
-    def add_field(self, name, field_break=2):
-        """Add a label element for the field."""
-        text = '%s: ' % (name.replace('_', ' ').title())
-        label = tk.Label(master=self.window, text=text, height=2, width=12,
-                         anchor=tk.E)
-        label.grid(row=self.row, column=self.col)
-        self.col += 1
-        """Add an entry element for the field."""
-        entry = tk.Entry(master=self.window, textvariable=tk.StringVar(),
-                         width=16)
-        entry.grid(row=self.row, column=self.col)
-        self.col += 1
-        """Return to column 0 of the next row, if the field-break has been
-        encountered. The field-break limits the continued horizontal placement
-        of new fields within the current row."""
-        if self.col > (field_break - 1) * 2:
-            self.col = 0
-            self.row += 1
-        self.lbl[name] = label
-        self.ent[name] = entry
+    When the '--sample' option is specified, then the database-table's column
+    data types are inferred from just the first <COUNT> records of the seed
+    file, rather than from a full pass over the whole file.
 
-    def add_list(self):
-        self.row += 1
-        self.col = 0
-        """Add a listbox element."""
-        listbox = tk.Listbox(master=self.window, width=28)
-        listbox.grid(row=self.row, column=self.col, rowspan=6, columnspan=2,
-                 sticky=tk.E)
-        self.col += 2
-        """Add a scrollbar element."""
-        scrollbar = tk.Scrollbar(master=self.window)
-        scrollbar.grid(row=self.row, column=self.col, rowspan=6, sticky=tk.W)
-        """Link the listbox with the scrollbar, and vice-verse. Bind to a click
-        event within the listbox."""
-        listbox.configure(yscrollcommand=scrollbar.set)
-        scrollbar.configure(command=listbox.yview)
-        listbox.bind(sequence='<<ListboxSelect>>', func=self.get_selected)
-        self.col += 1
-        self.lst = listbox
+    When the '--jobs' option is specified, then the seed file is split into
+    chunks of whole records, and <COUNT> processes infer the column data types
+    from those chunks in parallel. The records are still written to the
+    database file by a single process.
 
-    def add_button(self, name, command):
-        """Add a button element."""
-        name = name.replace('_', ' ').title()
-        button = tk.Button(master=self.window, text=name, width='12',
-                           command=command)
-        button.grid(row=self.row, column=self.col, sticky=tk.E)
-        self.row += 1
-        self.btn[name] = button
+    When the '--key' option is specified, then an existing database is not
+    rebuilt, but refreshed in place from the seed file. Records are matched by
+    their values in the comma-seperated key <COLUMNS>, and a hash of each seed
+    record is kept, so that only new and changed records are written, and those
+    no longer in the seed file are deleted. The table's indexes are kept, as
+    are edits to any record whose seed data has not changed.
 
-    def get_selected(self, event):
-        """Determine which member in the listbox has been clicked, if any."""
-        try:
-            i = 0
-            index = self.lst.curselection()[i]
-            self.selected = self.lst.get(index)
-            """Populate the entry elements with the selected member's data."""
-            for field in self.fields:
-                i += 1
-                self.ent[field].delete(0, tk.END)
-                self.ent[field].insert(tk.END, self.selected[i])
-        except IndexError:
-            return
+    When the '--clean' option is specified, then each seed record is cleaned
+    up as it is read, ahead of type inference, by the comma-seperated
+    <CLEANERS>, in order, or by 'all' of them. The 'trim' cleaner strips
+    whitespace from fields, 'nulls' empties fields such as 'NULL' or 'n/a',
+    'numbers' writes numbers such as '$1,234.50' plainly, and 'dates' writes
+    dates such as '12 January 1969' as '1969-01-12'.
 
-################################################################################
-class Window():
-    """
-    Window generates a GUI interface via the UserInterface class and interfaces
-    with an Sqlite database via the Database class.
-    """
-    def __init__(self, window, title, db):
-        self.window = window
-        self.window.wm_title(string=title)
-        self.db = db
-        """Build the data-entry field list from the database-table column
-        names."""
-        fields = []
-        for column in self.db.get_column_names():
-            fields.append(column)
-        """Build the button element list."""
-        buttons = [
-            ('view_all', self.view_collection),
-            ('search', self.search_collection),
-            ('add_new', self.add_item),
-            ('update', self.update_item),
-            ('delete', self.delete_item),
-            ('close', self.window.quit)
-        ]
-        """Initialize the user interface."""
-        self.ui = UserInterface(self.window, fields, buttons)
-        self.view_collection()
+    When the '--title' option is specified, then <TITLE> is displayed as the
+    database-control interface's window title.
 
-    def view_collection(self):
-        """Display all records in the database table."""
-        self.ui.lst.delete(0, tk.END)
-        for record in self.db.get_all_records():
-            self.ui.lst.insert(tk.END, record)
+    When a COMMAND is specified, then no window is displayed. Instead, the
+    command is run against the database-table and its records are written to
+    standard output, one per line, as comma-seperated fields after a header
+    line of column names, or with '--format json' as JSON objects. The query
+    COLUMN=VALUE criteria accept the same operators as the window's search
+    fields, i.e. 'year=>=1970' or 'title=Led*'. The insert and update
+    commands write the resulting record, and a command exits with status 1
+    when its record is not found. With '--seed', the database is seeded
+    first, and the seeding report is written to standard error.
 
-    def search_collection(self):
-        """From the database table, search for all records that conform to
-        specified search criteria."""
-        val = {}
-        for name in self.db.get_column_names():
-            val[name] = self.ui.ent[name].get()
-        records = self.db.get_records(**val)
-        self.ui.lst.delete(0, tk.END)
-        for record in records:
-            self.ui.lst.insert(tk.END, (record))
+    With '--format columnar', records are instead written in a compact binary
+    format of typed column chunks, each with min/max stats, which can be read
+    back with lib/export.py. The export command reads the table in batches,
+    so that tables of any size are exported with bounded memory.
 
-    def add_item(self):
-        """Add a record to the database table."""
-        record = []
-        for name in self.db.get_column_names():
-            field = self.ui.ent[name].get()
-            if not field:
-                return
-            record.append(field)
-        self.db.add_record(record=record)
-        self.view_collection()
+    When the '--serve' option is specified, then no window is displayed.
+    Instead, the database's tables are served on <ADDRESS>, a port number that
+    may be preceded by a host name and a colon, i.e. 'localhost:8080', as an
+    HTTP service that answers in JSON. The host defaults to 127.0.0.1. Request
+    'GET /' lists the tables, 'GET /TABLE' returns a page of the records that
+    match the query's COLUMN=VALUE criteria, along with the query for the next
+    page, 'GET /TABLE/count' counts them, and 'GET /TABLE/export' streams them
+    all as JSON lines. A record is read by 'GET /TABLE/ID', added by 'POST
+    /TABLE', changed by 'PATCH /TABLE/ID' and deleted by 'DELETE /TABLE/ID',
+    with its fields as a JSON object in the request body. Reads are served side
+    by side, while writes are made one at a time, and the writes that arrive
+    together are committed together.
 
-    def update_item(self):
-        """Update with changes a record in the database table."""
-        try:
-            id = self.ui.selected[0]
-        except NameError:
-            return
-        val = {}
-        for name in self.db.get_column_names():
-            val[name] = self.ui.ent[name].get()
-            if not val[name]:
-                return
-        self.db.update_record(id=id, **val)
-        self.view_collection()
+    When the '--trace' option is specified, or the DB_APP_TRACE environment
+    variable is set to 1, then each statement that a search or an edit runs is
+    timed by the wall clock, so that time spent waiting on locks or syncing to
+    disk is counted, and tallied by its shape, i.e. its text with any values
+    left out. Statements that run for 100 ms or more are logged as they finish,
+    or for as long as the number of milliseconds that DB_APP_TRACE is set to, if
+    more than 1. A summary of the tallies, along with the query plans of the
+    slowest statements, is written to standard error every minute, and at exit.
 
-    def delete_item(self):
-        """Delete a record from the database table."""
-        try:
-            id = self.ui.selected[0]
-        except NameError:
-            return
-        self.db.delete_record(id)
-        self.view_collection()
+    When using seed data, the seed file's contents should consist of newline-
+    seperated data records. In addition, the database-table's column data will
+    correspond to the comma-seperated fields within each line of the seed file.
+    The first line in the seed file will specify the database-table's column
+    names, also comma-seperated. Fields may instead be seperated by tabs, pipes
+    or semicolons, which is detected from the first lines of the file. In a
+    '.jsonl' or '.ndjson' file, each line holds a JSON object instead, and the
+    column names are the keys of the first object.
+        """ % (script, script, script, script))
+        sys.exit(status)
 
 ################################################################################
 app = AppInterface()
 app.parse_args(args=sys.argv[1:])
+if app.trace:
+    enable_tracing()
 if app.seed:
-    seed_database(path=app.db_path, name=app.db_name)
+    """A command's standard output holds only its records, and so seeding
+    reports to standard error instead."""
+    with redirect_stdout(sys.stderr if app.command else sys.stdout):
+        try:
+            seed_database(path=app.db_path, name=app.db_name,
+                          sample=app.sample, jobs=app.jobs, key=app.key,
+                          cleaners=app.cleaners)
+        except (ValueError, sqlite3.Error) as e:
+            print('**Error: %s' % (e))
+            sys.exit(1)
+if app.command:
+    sys.exit(run_command(app))
+if app.serve:
+    """Only the server needs asyncio and a thread pool, and so its module is
+    imported here."""
+    from lib.server import HOST, serve
+    serve(path=app.db_path, name=app.db_name, host=app.serve[0] or HOST,
+          port=app.serve[1])
+    sys.exit(0)
+"""Only the user-interface window needs tkinter, which is slow to start."""
+import tkinter as tk
+from lib.gui import Window
+db = Database(path=app.db_path, name=app.db_name)
+if app.table and app.table not in db.get_tables():
+    app.show_usage('**Error: %s, "%s"' % ('table not found', app.table))
 app.window = tk.Tk()
-Window(window=app.window, title=app.title,
-        db=Database(path=app.db_path, name=app.db_name))
+Window(window=app.window, title=app.title, db=db, table=app.table)
 app.window.mainloop()
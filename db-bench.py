@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# db-bench.py v0.1
+
+# Benchmark the seed, search, edit and view-refresh paths of the db-app.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import sys
+import tempfile
+from lib.bench import SCHEMAS, TOLERANCE, compare_results, run_benchmarks
+
+################################################################################
+class BenchInterface():
+    """
+    BenchInterface parses arguments from the command-line and responds there,
+    if necessary.
+    """
+    def __init__(self):
+        """Start with generic values, to be updated from command-line args."""
+        self.schema = 'books'
+        self.rows = '10000'
+        self.cardinality = '1000'
+        self.mix = '0'
+        self.calls = '200'
+        self.output = None
+        self.baseline = None
+        self.tolerance = str(TOLERANCE)
+        self.db_path = None
+
+    def parse_args(self, args):
+        """
+        Parse command-line arguments and set instance variables for the app.
+        """
+        options = {
+            '-s': 'schema', '--schema': 'schema',
+            '-r': 'rows', '--rows': 'rows',
+            '-c': 'cardinality', '--cardinality': 'cardinality',
+            '-m': 'mix', '--mix': 'mix',
+            '-n': 'calls', '--calls': 'calls',
+            '-o': 'output', '--output': 'output',
+            '-b': 'baseline', '--baseline': 'baseline',
+            '-t': 'tolerance', '--tolerance': 'tolerance',
+            '-p': 'db_path', '--path': 'db_path',
+        }
+        while args:
+            """Show the help message text for the app."""
+            if args[0] == '-h' or args[0] == '--help':
+                self.show_usage(status=0)
+            """Every other option takes a value."""
+            if args[0] not in options or len(args) < 2:
+                self.show_usage('**Error: %s' % ('incorrect usage'))
+            setattr(self, options[args.pop(0)], args.pop(0))
+        """Validity-check the instance variables. Quit if invalid."""
+        if self.schema not in SCHEMAS:
+            msg = '**Error: %s, "%s"' % ('unknown schema', self.schema)
+            self.show_usage(msg)
+        for name in ('rows', 'cardinality', 'calls'):
+            value = getattr(self, name)
+            if not value.isdigit() or not int(value):
+                msg = '**Error: invalid %s count, "%s"' % (name, value)
+                self.show_usage(msg)
+            setattr(self, name, int(value))
+        for name in ('mix', 'tolerance'):
+            value = getattr(self, name)
+            try:
+                setattr(self, name, float(value))
+            except ValueError:
+                setattr(self, name, -1.0)
+            if not 0 <= getattr(self, name) <= 1:
+                msg = '**Error: invalid %s fraction, "%s"' % (name, value)
+                self.show_usage(msg)
+        if self.db_path and not os.path.isdir(self.db_path):
+            msg = '**Error: %s, "%s"' % ('directory not found', self.db_path)
+            self.show_usage(msg)
+        if self.baseline and not os.path.isfile(self.baseline):
+            msg = '**Error: %s, "%s"' % ('baseline not found', self.baseline)
+            self.show_usage(msg)
+
+    def show_usage(self, status):
+        """
+        Display usage text to the command line interface, and then exit.
+        """
+        script = os.path.basename(__file__)
+        print("""
+Usage: %s [--schema SCHEMA] [--rows COUNT] [--cardinality COUNT] [--mix FRACTION] [--calls COUNT] [--path DIRECTORY] [--output FILE] [--baseline FILE [--tolerance FRACTION]]
+       %s --help
+
+   Options:
+        -s | --schema SCHEMA        Model the seed data on books, garden or ledzep.
+        -r | --rows COUNT           Generate COUNT seed records.
+        -c | --cardinality COUNT    Draw each column from COUNT distinct values.
+        -m | --mix FRACTION         Write FRACTION of integer fields as text.
+        -n | --calls COUNT          Time COUNT calls of each search and edit.
+        -p | --path DIRECTORY       Work in DIRECTORY, not a temporary one.
+        -o | --output FILE          Write the JSON results to FILE.
+        -b | --baseline FILE        Compare the results with those in FILE.
+        -t | --tolerance FRACTION   Allow FRACTION slower than the baseline.
+        -h | --help                 Print this message text.
+
+    This script generates a seed file of synthetic records, modelled on one of
+    the seed files in 'data', then seeds a database from it and times the hot
+    paths of the db-app against that database. The results are written as
+    JSON, with each path's throughput and p50/p99 latencies, and the peak
+    resident set size of the process.
+
+    When the '--baseline' option is specified, then each path's throughput is
+    compared with its throughput in <FILE>, a saved earlier output. The script
+    exits with status 1 if any path is slower than its baseline by more than
+    the tolerance, which defaults to %s.
+        """ % (script, script, TOLERANCE))
+        sys.exit(status)
+
+################################################################################
+app = BenchInterface()
+app.parse_args(args=sys.argv[1:])
+with tempfile.TemporaryDirectory() as temp_path:
+    results = run_benchmarks(path=app.db_path or temp_path, schema=app.schema,
+                             rows=app.rows, cardinality=app.cardinality,
+                             mix=app.mix, calls=app.calls)
+status = 0
+if app.baseline:
+    with open(file=app.baseline) as file:
+        baseline = json.load(file)
+    ratios, regressions = compare_results(results, baseline, app.tolerance)
+    results['baseline'] = {'file': app.baseline, 'ratios': ratios,
+                           'regressions': regressions}
+    status = 1 if regressions else 0
+    if baseline.get('config') != results['config']:
+        print('**Warning: the baseline was run with another configuration',
+              file=sys.stderr)
+text = json.dumps(results, indent=2, sort_keys=True)
+if app.output:
+    with open(file=app.output, mode='w') as file:
+        file.write(text + '\n')
+else:
+    print(text)
+for name in results.get('baseline', {}).get('regressions', []):
+    print('**Regression: %s at %.0f%% of baseline throughput' %
+          (name, ratios[name] * 100), file=sys.stderr)
+sys.exit(status)
@@ -0,0 +1,232 @@
+# bench.py v0.1                                                   -*- Python -*-
+
+# Time the hot paths of seeding, searching and editing an sqlite database-table.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import os
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+from itertools import islice
+from .db import Database
+from .pager import Pager, prefetch
+from .seed import seed_database, _get_column_types
+from .source import SeedSource
+
+"""The synthetic seed data schemas, modelled on the seed files in 'data'. Each
+column is a (name, kind, base) tuple. An 'int' column's values count up from
+its base, while the other kinds draw on the WORDS and MONTHS below."""
+SCHEMAS = {
+    'books': (
+        ('title', 'text', None),
+        ('author', 'name', None),
+        ('year', 'int', 1950),
+        ('isbn', 'int', 1000000000),
+    ),
+    'garden': (
+        ('name', 'text', None),
+        ('species', 'name', None),
+        ('type', 'text', None),
+        ('size', 'text', None),
+        ('habitat', 'text', None),
+    ),
+    'ledzep': (
+        ('album_title', 'text', None),
+        ('release_date', 'date', None),
+        ('label', 'name', None),
+        ('category', 'text', None),
+    ),
+}
+WORDS = ('Python', 'Programming', 'Core', 'Learning', 'Introduction', 'Guide',
+         'Orchid', 'Mint', 'Woods', 'Pastures', 'Island', 'Creek', 'Zeppelin',
+         'Houses', 'Holy', 'Physical', 'Graffiti', 'Presence', 'Studio', 'Live')
+MONTHS = ('January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December')
+
+"""The count of timed calls made to each search and edit path, and the count
+of rows shown by a headless view refresh."""
+BENCH_CALLS = 200
+VIEW_ROWS = 10
+
+"""A benchmark has regressed when its throughput falls below its baseline
+throughput by more than this fraction."""
+TOLERANCE = 0.2
+
+def write_seed_file(seed_file, schema, rows, cardinality, mix=0.0, seed=0):
+    """
+    Write a csv-formatted seed file of 'rows' synthetic records, in the named
+    schema. Each column holds at most 'cardinality' distinct values. The
+    'mix' is the fraction of 'int' column fields that are written as 'n/a'
+    instead, so that those columns are inferred as TEXT.
+    """
+    rng = random.Random(seed)
+    columns = SCHEMAS[schema]
+    pools = [_get_value_pool(rng, kind, base, cardinality)
+             for name, kind, base in columns]
+    numeric = [kind == 'int' for name, kind, base in columns]
+    with open(file=seed_file, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([name.upper() for name, kind, base in columns])
+        for i in range(rows):
+            writer.writerow(['n/a' if numeric[j] and mix and rng.random() < mix
+                             else rng.choice(pool)
+                             for j, pool in enumerate(pools)])
+
+def _get_value_pool(rng, kind, base, cardinality):
+    """Return a list of 'cardinality' distinct field values of a kind."""
+    if kind == 'int':
+        return [str(base + i) for i in range(cardinality)]
+    if kind == 'date':
+        return ['%d %s %d' % (i % 28 + 1, MONTHS[i // 28 % 12],
+                              1950 + i // 336) for i in range(cardinality)]
+    if kind == 'name':
+        return ['%s %s.%d' % (rng.choice(WORDS), rng.choice(WORDS), i)
+                for i in range(cardinality)]
+    return ['%s %d' % (' '.join(rng.sample(WORDS, rng.randint(1, 4))), i)
+            for i in range(cardinality)]
+
+def run_benchmarks(path, schema='books', rows=10000, cardinality=1000,
+                   mix=0.0, calls=BENCH_CALLS, seed=0):
+    """
+    Generate a seed file in the directory 'path', and then time each of the
+    hot paths against the database seeded from it. Return the results as a
+    dictionary, ready to be written as JSON. Anything printed by the paths
+    being timed is discarded.
+    """
+    name = 'bench_%s' % (schema)
+    seed_file = os.path.normpath('%s/%s.csv' % (path, name))
+    write_seed_file(seed_file, schema, rows, cardinality, mix, seed)
+    rng = random.Random(seed)
+    results = {}
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        results['seed'] = _time_calls(
+                [lambda: seed_database(path=path, name=name)], rows)
+        records = islice(SeedSource(file=seed_file), 1, None)
+        results['column_types'] = _time_calls(
+                [lambda: _get_column_types(records=records)], rows)
+        with Database(path=path, name=name) as db:
+            results.update(_time_database(db, rng, calls))
+    results['peak_rss_kb'] = get_peak_rss()
+    results['config'] = {'schema': schema, 'rows': rows, 'mix': mix,
+                         'cardinality': cardinality, 'calls': calls,
+                         'seed': seed}
+    return results
+
+def _time_database(db, rng, calls):
+    """
+    Time the search, edit and view refresh paths of a seeded Database. The
+    searches and view refreshes are timed with the Database's ResultCache
+    cleared before each call, so that they run their statements, and then
+    timed again as repeats that the cache answers, as the '_cached' results.
+    """
+    results = {}
+    names = db.get_column_names()
+    sample = db.get_records(id='<=%d' % (calls))
+    values = [rng.choice(sample) for i in range(calls)]
+    searches = [lambda r=r: db.get_records(**{names[0]: r[1]}) for r in values]
+    results['search_exact'] = _time_calls(searches, setup=db.cache.clear)
+    results['search_exact_cached'] = _time_repeats(searches)
+    prefixes = ['%s*' % (str(r[1])[:3]) for r in values]
+    searches = [lambda p=p: db.get_records(**{names[0]: p}) for p in prefixes]
+    results['search_prefix'] = _time_calls(searches, setup=db.cache.clear)
+    results['search_prefix_cached'] = _time_repeats(searches)
+    ids = []
+    results['add_record'] = _time_calls(
+            [lambda r=r: ids.append(db.add_record(record=list(r[1:])))
+             for r in values])
+    results['update_record'] = _time_calls(
+            [lambda id=id, r=r: db.update_record(id=id, **{names[-1]: r[-1]})
+             for id, r in zip(ids, reversed(values))])
+    results['delete_record'] = _time_calls(
+            [lambda id=id: db.delete_record(id=id) for id in ids])
+    refreshes = [lambda: _refresh_view(db) for i in range(calls)]
+    results['view_refresh'] = _time_calls(refreshes, setup=db.cache.clear)
+    results['view_refresh_cached'] = _time_repeats(refreshes)
+    return results
+
+def _refresh_view(db):
+    """Do what the window's View All does, short of drawing the rows."""
+    count, first_page = prefetch(db)
+    return Pager(db=db, count=count,
+                 first_page=first_page).get_records(0, VIEW_ROWS)
+
+def _time_repeats(calls):
+    """Time the passed calls as repeats, each having been made once already,
+    untimed, so that their results are cached."""
+    for call in calls:
+        call()
+    return _time_calls(calls)
+
+def _time_calls(calls, ops=None, setup=None):
+    """
+    Make each of the passed calls in turn, timing each one, after calling
+    setup(), untimed, if passed. Return the total time, the throughput in
+    'ops' operations per second, which defaults to one per call, and the p50
+    and p99 latencies of a call, in milliseconds.
+    """
+    latencies = []
+    for call in calls:
+        if setup:
+            setup()
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    total = sum(latencies)
+    ops = ops if ops is not None else len(calls)
+    latencies.sort()
+    return {
+        'seconds': round(total, 6),
+        'ops': ops,
+        'throughput': round(ops / total, 3) if total else None,
+        'p50_ms': round(_get_percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(_get_percentile(latencies, 0.99) * 1000, 3),
+    }
+
+def _get_percentile(latencies, fraction):
+    """Return the nearest-rank percentile of a sorted list of latencies."""
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+def get_peak_rss():
+    """Return the peak resident set size of this process in KiB, or None where
+    the platform can't report it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    """Linux reports KiB, while macOS reports bytes."""
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def compare_results(results, baseline, tolerance=TOLERANCE):
+    """
+    Compare each benchmark's throughput with that of a baseline run. Return a
+    dictionary of each shared benchmark's throughput ratio to its baseline,
+    and a list of the benchmarks whose ratio fell below 1 - 'tolerance'.
+    """
+    ratios = {}
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if not isinstance(result, dict) or not isinstance(base, dict) or \
+                not result.get('throughput') or not base.get('throughput'):
+            continue
+        ratios[name] = round(result['throughput'] / base['throughput'], 3)
+        if ratios[name] < 1 - tolerance:
+            regressions.append(name)
+    return ratios, regressions
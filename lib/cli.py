@@ -0,0 +1,95 @@
+# cli.py v0.1                                                     -*- Python -*-
+
+# Administer records in an sqlite database-table from the command-line.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sqlite3
+import sys
+from contextlib import redirect_stdout
+from .db import Database
+from .export import WRITERS, iter_table
+
+def run_command(app):
+    """
+    Run the command that was parsed from the command-line into 'app', against
+    its database. Records are written to standard output in the parsed format,
+    while anything else is written to standard error. Return an exit status.
+    """
+    out = sys.stdout
+    write = WRITERS[app.format]
+    with redirect_stdout(sys.stderr):
+        with Database(path=app.db_path, name=app.db_name) as db:
+            try:
+                if app.table:
+                    db = db.get_table(app.table)
+                return COMMANDS[app.command](db, out, write, **app.fields)
+            except (ValueError, sqlite3.Error) as e:
+                print('**Error: %s' % (e))
+                return 1
+
+def _query(db, out, write, **kwargs):
+    """Write the records that match the passed search criteria."""
+    write(out, db.get_column_names(pkey=True), db.iter_records(**kwargs))
+    return 0
+
+def _export(db, out, write, **kwargs):
+    """Write every record in the table, read in batches."""
+    if kwargs:
+        raise ValueError('export takes no COLUMN=VALUE fields')
+    write(out, db.get_column_names(pkey=True), iter_table(db))
+    return 0
+
+def _insert(db, out, write, **kwargs):
+    """Add a record with the passed fields, and write it."""
+    names = db.get_column_names()
+    missing = [name for name in names if name not in kwargs]
+    if missing or len(kwargs) != len(names):
+        raise ValueError('insert takes exactly one of each field: %s' %
+                         (', '.join(names)))
+    id = db.add_record(record=[kwargs[name] for name in names])
+    write(out, db.get_column_names(pkey=True), [db.get_record(id)])
+    return 0
+
+def _update(db, out, write, id=None, **kwargs):
+    """Change the passed fields of the record with the passed id, and write
+    it. Return 1 if there is no such record."""
+    if id is None or not kwargs:
+        raise ValueError('update takes id=ID and at least one other field')
+    if not db.get_record(id):
+        return 1
+    write(out, db.get_column_names(pkey=True),
+          [db.update_record(id=id, **kwargs)])
+    return 0
+
+def _delete(db, out, write, id=None, **kwargs):
+    """Delete the record with the passed id. Return 1 if there is no such
+    record."""
+    if id is None or kwargs:
+        raise ValueError('delete takes just id=ID')
+    if not db.get_record(id):
+        return 1
+    db.delete_record(id=id)
+    return 0
+
+"""The command-line commands, by name."""
+COMMANDS = {
+    'query': _query,
+    'insert': _insert,
+    'update': _update,
+    'delete': _delete,
+    'export': _export,
+}
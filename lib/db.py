@@ -17,10 +17,301 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import copy
+import hashlib
+import queue
 import sqlite3
+import string
+import sys
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+from pathlib import Path
+from . import trace
+
+"""Connection settings applied for the duration of a bulk load, and then
+restored to their previous values afterwards."""
+BULK_PRAGMAS = (
+    ('journal_mode', 'MEMORY'),
+    ('synchronous', 'OFF'),
+    ('cache_size', -262144),
+)
+BULK_BATCH_SIZE = 10000
+
+"""The table that keeps each seeded record's natural key and a hash of its seed
+data, so that a re-seed need only write the records whose seed data changed.
+The parts of a natural key are joined by a separator that seed data won't
+hold."""
+SEED_TABLE = '%s_seed'
+KEY_SEPARATOR = '\x1f'
+"""A NULL field, as the 'nulls' cleaner makes, is joined as this instead, so
+that it hashes apart from an empty field."""
+NULL_FIELD = '\x00'
+
+"""A combination of search columns is hot, and so is indexed automatically,
+once it has been searched this many times, taking this long on average."""
+HOT_SEARCH_COUNT = 3
+HOT_SEARCH_SECONDS = 0.01
+
+"""The count of compiled statements that each connection keeps for reuse. The
+statements are parameterized, so there is one per query shape, not per value."""
+CACHED_STATEMENTS = 256
+
+"""Settings for every connection. In WAL mode, readers and a writer do not
+block each other, and a sync at each commit is not needed for durability
+against a process crash. A connection that finds the database locked retries
+until the busy timeout, rather than failing at once."""
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+)
+BUSY_TIMEOUT_SECONDS = 5.0
+READ_POOL_SIZE = 4
+
+"""The table's column names and data-types, each as a tuple in column order,
+the primary key column's name, its indexes as (name, columns) tuples, and the
+columns of its full-text index, if any. The schema is re-read when its version
+changes, checked at most this often."""
+Schema = namedtuple('Schema', ['names', 'types', 'pkey', 'indexes',
+                               'text_columns'])
+SCHEMA_CHECK_SECONDS = 1.0
+
+"""The results of searches are kept for reuse, the least recently used of them
+dropped first, up to this many rows and about this many bytes in all. A result
+that is larger than either bound is not kept."""
+CACHE_ROWS = 100000
+CACHE_BYTES = 32 * 1024 * 1024
+
+"""Comparison operators that may lead a search criterion. Two-character
+operators are listed ahead of the one-character operators they begin with."""
+OPERATORS = ('>=', '<=', '!=', '<>', '>', '<', '=')
+COLLATIONS = ('BINARY', 'NOCASE', 'RTRIM')
+
+"""The NOCASE collation folds the case of ASCII letters only, and so only they
+are lowered in the bounds of a prefix's case-insensitive range."""
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def get_row_hash(record):
+    """Return a stable 64-bit hash of a record's fields, as an integer."""
+    digest = hashlib.blake2b(join_fields(record).encode(),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+def join_fields(fields):
+    """Return the passed text fields, any of which may be None, as one text."""
+    return KEY_SEPARATOR.join(NULL_FIELD if field is None else field
+                              for field in fields)
+
+def parse_criterion(value):
+    """
+    Split a search criterion into an operator and a list of its operands. The
+    criterion may be a comparison such as '>=1970' or '!=x', a range such as
+    '1970..1980' (either end of which may be left open), or a prefix such as
+    'Led*'. Any other value, or the rest of a value that begins with '=', is
+    matched exactly, as are '..' alone and values such as 'Wait...', which
+    are not one '..' between bounds. Values that are not strings are always
+    matched exactly.
+    """
+    if not isinstance(value, str):
+        return '=', [value]
+    for operator in OPERATORS:
+        if value.startswith(operator):
+            operator = '!=' if operator == '<>' else operator
+            return operator, [value[len(operator):]]
+    low, separator, high = value.partition('..')
+    if separator and (low or high) and '..' not in high and \
+            not low.endswith('.') and not high.startswith('.'):
+        return '..', [low, high]
+    if len(value) > 1 and value.endswith('*'):
+        return '*', [value[:-1]]
+    return '=', [value]
+
+################################################################################
+class ConnectionManager():
+    """
+    ConnectionManager opens the connections to one database file. There is a
+    single writer connection, and a pool of up to 'readers' read-only
+    connections, which are opened as they are first needed. All connections
+    are closed together when the manager is closed, or at the end of a 'with'
+    block. While tracing is enabled, every connection is traced. While 'hold'
+    is set, as by an EditJournal, the Database record edits made through the
+    writer leave their transaction open rather than commit it.
+    """
+    def __init__(self, file, readers=READ_POOL_SIZE):
+        self.file = file
+        self.size = readers
+        self.pool = queue.LifoQueue()
+        self.opened = []
+        self.closed = False
+        self.hold = False
+        self.tracer = trace.get_tracer()
+        trace.watch(self)
+        self.writer = self._connect(database=self.file)
+        for name, value in CONNECTION_PRAGMAS:
+            self.writer.execute('PRAGMA %s=%s' % (name, value))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def reader(self):
+        """
+        Lend out a read-only connection for the duration of a 'with' block,
+        waiting for one to be returned if all are already lent out. A lent
+        connection may be used by any one thread at a time.
+        """
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            if len(self.opened) < self.size:
+                uri = '%s?mode=ro' % (Path(self.file).resolve().as_uri())
+                conn = self._connect(database=uri, uri=True,
+                                     check_same_thread=False)
+                conn.execute('PRAGMA synchronous=NORMAL')
+                self.opened.append(conn)
+            else:
+                conn = self.pool.get()
+        try:
+            yield conn
+        finally:
+            self.pool.put(conn)
+
+    def _connect(self, **kwargs):
+        """Open a connection with the settings shared by all connections."""
+        conn = sqlite3.connect(timeout=BUSY_TIMEOUT_SECONDS,
+                               cached_statements=CACHED_STATEMENTS, **kwargs)
+        if self.tracer:
+            self.tracer.attach(conn, explain=self.explain)
+        return conn
+
+    def set_tracer(self, tracer):
+        """Attach the passed Tracer to every open connection, or detach the
+        current one from them when passed None."""
+        if self.tracer is tracer:
+            return
+        for conn in [self.writer] + self.opened:
+            if self.tracer:
+                self.tracer.detach(conn)
+            if tracer:
+                tracer.attach(conn, explain=self.explain)
+        self.tracer = tracer
+
+    def explain(self, sql):
+        """
+        Return the query plan of a statement as a list of the plan's detail
+        lines, looked up on a read-only connection. The plan is empty when it
+        can't be looked up.
+        """
+        if self.closed:
+            return []
+        try:
+            with self.reader() as conn:
+                plan = conn.execute('EXPLAIN QUERY PLAN %s' % (sql))
+                return [row[3] for row in plan.fetchall()]
+        except sqlite3.Error:
+            return []
+
+    def close(self):
+        """
+        Close the writer and every read-only connection, unless they are
+        closed already.
+        """
+        if self.closed:
+            return
+        self.set_tracer(None)
+        self.closed = True
+        for conn in self.opened:
+            conn.close()
+        self.opened = []
+        self.writer.close()
+
+################################################################################
+class ResultCache():
+    """
+    ResultCache keeps the results of searches, by their table, statement text
+    and parameters. Each result is stamped with the table's write generation,
+    which its Database bumps with each write to the table, and with the data
+    version of the connection that read it, which Sqlite changes once another
+    connection, in this process or any other, commits a write. A result whose
+    stamp is out of date is stale, and is dropped when next looked up.
+    """
+    def __init__(self, rows=CACHE_ROWS, size=CACHE_BYTES):
+        self.rows = rows
+        self.size = size
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.row_count = 0
+        self.byte_count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_generation(self, table):
+        """Return the named table's write generation."""
+        return self.generations.get(table, 0)
+
+    def bump(self, table):
+        """Start a new write generation for the named table, which makes every
+        result kept for it stale."""
+        self.generations[table] = self.get_generation(table) + 1
+
+    def get(self, key, stamp):
+        """Return the result kept under 'key', or None if there is none, or if
+        it is stale, having been stamped other than with 'stamp'."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] != stamp:
+            self._drop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, stamp, result):
+        """Keep a result under 'key', with its stamp, and then drop the least
+        recently used results until the cache is back within its bounds."""
+        rows, size = self._measure(result)
+        if rows > self.rows or size > self.size:
+            return
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = (stamp, result, rows, size)
+        self.row_count += rows
+        self.byte_count += size
+        while self.row_count > self.rows or self.byte_count > self.size:
+            self._drop(next(iter(self.entries)))
+
+    def clear(self):
+        """Drop every result."""
+        self.entries.clear()
+        self.row_count = 0
+        self.byte_count = 0
+
+    def _drop(self, key):
+        """Drop the result kept under 'key'."""
+        stamp, result, rows, size = self.entries.pop(key)
+        self.row_count -= rows
+        self.byte_count -= size
+
+    def _measure(self, result):
+        """Return the count of rows in a result, which is a list of records or
+        a single value, and roughly how many bytes it takes up."""
+        if not isinstance(result, list):
+            return 1, sys.getsizeof(result)
+        size = sys.getsizeof(result)
+        for record in result:
+            size += sys.getsizeof(record) + sum(map(sys.getsizeof, record))
+        return len(result), size
 
 ################################################################################
-### TODO: add the capacity to manage multiple database tables and sensibly switch between them.
 class Database():
     """
     Database opens a connection to an existing database, or instead create a
@@ -28,40 +319,153 @@ class Database():
     and types is passed upon instantiation, and if a table does not exist in the
     database, then a new, empty table is created. The database that is created
     consists of one table that duplicates the name of the database itself.
+    Other tables in the database are reached through handles from get_table().
+    Search results are kept in a ResultCache, shared with those handles, and
+    repeated searches are answered from it for as long as the table is not
+    written to.
     """
     def __init__(self, path, name, **kwargs):
+        self.path = path
         self.file = '%s/%s.db' % (path, name)
         self.table = name
-        self.conn = sqlite3.connect(database=self.file)
+        self.connections = ConnectionManager(file=self.file)
+        self.conn = self.connections.writer
         self.curs = self.conn.cursor()
+        self.auto_index = True
+        self.searches = {}
+        self.indexed = set()
+        self.owner = True
+        self.handles = {}
+        self.schemas = {}
+        self.schema_state = {'version': None, 'checked': 0}
+        self.cache = ResultCache()
         if kwargs:
             sql = 'CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY' % \
                     (self.table)
             for key in kwargs:
                 sql += ', %s %s' % (key.lower(), kwargs[key])
             sql += ')'
-            print(sql)
             self.curs.execute(sql)
             self.conn.commit()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def __del__(self):
-        """Close the database connection."""
+        """Close the database connections, if not closed already."""
         self.close()
 
+    def reader(self):
+        """
+        Lend out a read-only connection to the database for the duration of a
+        'with' block. Reads on it run alongside this Database's writes.
+        """
+        return self.connections.reader()
+
+    def get_tables(self):
+        """
+        Return a list of the names of the database's tables. Full-text index
+        tables, the tables that Sqlite keeps for them, and the tables of seed
+        hashes are not included.
+        """
+        sql = "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND " \
+              "name NOT LIKE 'sqlite_%' ORDER BY name"
+        tables = self.curs.execute(sql).fetchall()
+        virtual = [name for name, sql in tables
+                   if sql.upper().startswith('CREATE VIRTUAL TABLE')]
+        names = set(name for name, sql in tables)
+        return [name for name, sql in tables if not any(
+                name == table or name.startswith(table + '_')
+                for table in virtual) and not any(
+                name == SEED_TABLE % (table) for table in names)]
+
+    def get_table(self, name):
+        """
+        Return a handle on the named table of the database, which is a Database
+        that shares this one's connections and schema cache. The handle is
+        built the first time that it is asked for, and closing it leaves the
+        shared connections open.
+        """
+        if name == self.table:
+            return self
+        if name not in self.handles:
+            if name not in self.get_tables():
+                raise ValueError('no such table: %r' % (name))
+            handle = copy.copy(self)
+            handle.table = name
+            handle.curs = self.conn.cursor()
+            handle.searches = {}
+            handle.indexed = set()
+            handle.owner = False
+            self.handles[name] = handle
+        return self.handles[name]
+
+    def get_reader(self, conn):
+        """
+        Return a handle on the table that reads through the passed read-only
+        connection, as lent out by reader(), for the duration of the loan. It
+        has a ResultCache of its own, since the data version that stamps the
+        results is the connection's own, and it doesn't index automatically,
+        since it can't write. Its get_table() handles read through the same
+        connection.
+        """
+        handle = copy.copy(self)
+        handle.conn = conn
+        handle.curs = conn.cursor()
+        handle.auto_index = False
+        handle.searches = {}
+        handle.indexed = set()
+        handle.owner = False
+        handle.handles = {}
+        handle.cache = ResultCache()
+        return handle
+
+    def get_schema(self):
+        """
+        Return the table's Schema. It is read once, and then again only after
+        this connection changes it, or after the database's schema version is
+        found to have changed.
+        """
+        schema = self.schemas.get(self.table)
+        state = self.schema_state
+        now = time.perf_counter()
+        if schema and now - state['checked'] < SCHEMA_CHECK_SECONDS:
+            return schema
+        state['checked'] = now
+        version = self.curs.execute('PRAGMA schema_version').fetchone()[0]
+        if version != state['version']:
+            self.schemas.clear()
+            state['version'] = version
+        elif schema:
+            return schema
+        sql = 'PRAGMA table_info(%s)' % (self.table)
+        columns = self.curs.execute(sql).fetchall()
+        pkey = None
+        for column in columns:
+            if column[5]:
+                pkey = column[1]
+        schema = Schema(names=tuple(column[1] for column in columns),
+                        types=tuple(column[2] for column in columns),
+                        pkey=pkey, indexes=self._get_indexes(),
+                        text_columns=self._get_text_columns())
+        self.schemas[self.table] = schema
+        return schema
+
+    def _reset_schema(self):
+        """Have the next get_schema() call re-read the schema."""
+        self.schemas.pop(self.table, None)
+
     def get_column_names(self, pkey=False):
         """
         Return a list of the table's column names. The table's primary key is
         not included, by default. Use 'pkey=True' to include that column's
         name as well.
         """
-        sql = 'PRAGMA table_info(%s)' % (self.table)
-        columns = self.curs.execute(sql).fetchall()
-        names = []
-        for i in range(len(columns)):
-            if pkey == False and columns[i][0] == 0:
-                continue
-            names.append(columns[i][1])
-        return names
+        schema = self.get_schema()
+        return [name for name in schema.names if pkey or name != schema.pkey]
 
     def get_column_types(self, pkey=False):
         """
@@ -69,78 +473,714 @@ class Database():
         is not included, by default. Use 'pkey=True' to include that column's
         type as well.
         """
-        sql = 'PRAGMA table_info(%s)' % (self.table)
-        columns = self.curs.execute(sql).fetchall()
-        types = []
-        for i in range(len(columns)):
-            if pkey == False and columns[i][0] == 0:
-                continue
-            types.append(columns[i][2])
-        return types
+        schema = self.get_schema()
+        return [type for name, type in zip(schema.names, schema.types)
+                if pkey or name != schema.pkey]
 
     def get_all_records(self):
         """
         Return a list of all table records.
         """
         sql = 'SELECT * FROM %s' % (self.table)
-        print(sql)
-        return self.curs.execute(sql).fetchall()
+        return self._query(sql)
 
-    def get_records(self, **kwargs):
+    def iter_records(self, match=None, **kwargs):
         """
-        Return a list of the database records that match the passed search
-        criteria.
+        Return an iterator over the database records that match the passed
+        search criteria, and the full-text query 'match' when passed, in 'id'
+        order. The iterator is a cursor of its own, which reads each record as
+        it is iterated, rather than fetching all of them up front.
+        """
+        where, params = self._get_criteria(match=match, **kwargs)
+        sql = 'SELECT * FROM %s%s ORDER BY id' % (self.table, where)
+        """Only the first step is timed, as the rest are taken by the caller."""
+        with self._timed():
+            return self.conn.cursor().execute(sql, params)
+
+    def count_records(self, match=None, **kwargs):
+        """
+        Return the count of database records that match the passed search
+        criteria, and the full-text query 'match' when passed. Criteria with
+        empty values are ignored.
+        """
+        where, params = self._get_criteria(match=match, **kwargs)
+        sql = 'SELECT COUNT(*) FROM %s%s' % (self.table, where)
+        return self._query(sql, params, scalar=True, criteria=kwargs)
+
+    def get_record(self, id, match=None, **kwargs):
+        """
+        Return the database record that corresponds with the passed 'id', or
+        None if there is no such record or it fails the passed search criteria
+        or full-text query.
+        """
+        where, params = self._get_criteria(match=match, **kwargs)
+        """The id is bound as is, rather than parsed as a search criterion, so
+        that any id, even 0, is only ever matched exactly."""
+        where = ' WHERE id = ?%s' % (where.replace(' WHERE', ' AND', 1))
+        sql = 'SELECT * FROM %s%s' % (self.table, where)
+        params.insert(0, id)
+        with self._timed():
+            return self.curs.execute(sql, params).fetchone()
+
+    def get_page(self, after=None, offset=0, limit=100, match=None,
+                 cache=True, **kwargs):
+        """
+        Return a list of up to 'limit' database records that match the passed
+        search criteria, in 'id' order. The page begins just past the record
+        whose id is 'after', when passed, which lets the 'id' index seek
+        directly to it. Otherwise the page begins 'offset' records in. When a
+        full-text query 'match' is passed, then only records that match it are
+        returned, ranked best first, and 'after' is not used. A page that is
+        read just once, as by an export, may bypass the ResultCache, when
+        'cache' is unset, so that it doesn't crowd out the searches kept there.
         """
-        sql = 'SELECT * FROM %s WHERE' % (self.table)
-        for key in kwargs:
+        where, params = self._get_criteria(**kwargs)
+        if match:
+            return self._get_match_page(match, where, params, offset, limit,
+                                        cache=cache)
+        if after is not None:
+            where += ' AND' if where else ' WHERE'
+            where += ' id > ?'
+            params.append(after)
+            offset = 0
+        sql = 'SELECT * FROM %s%s ORDER BY id LIMIT ? OFFSET ?' % \
+                (self.table, where)
+        params += [limit, offset]
+        return self._query(sql, params, criteria=kwargs, cache=cache)
+
+    def _get_match_page(self, match, where, params, offset, limit, cache=True):
+        """
+        Return a page of the records that match a full-text query and the
+        passed WHERE clause, ranked by bm25.
+        """
+        sql = 'SELECT %s.* FROM (SELECT rowid, rank FROM %s_fts WHERE ' \
+              '%s_fts MATCH ?) AS m JOIN %s ON id = m.rowid%s ' \
+              'ORDER BY m.rank LIMIT ? OFFSET ?' % \
+              (self.table, self.table, self.table, self.table, where)
+        return self._query(sql, [match] + params + [limit, offset],
+                           cache=cache)
+
+    def _get_criteria(self, match=None, **kwargs):
+        """
+        Return a parameterized WHERE clause that matches the passed search
+        criteria, and the full-text query 'match' when passed, and a list of
+        its parameters. Criteria with empty values are ignored, and with no
+        criteria left the clause is empty. The columns are always listed in the
+        same order, so that each combination of columns has just one statement
+        text.
+        """
+        self._check_columns(kwargs)
+        terms = []
+        params = []
+        for key in sorted(kwargs):
             if not kwargs[key]:
                 continue
-            sql += ' %s="%s" AND' % (key, kwargs[key])
-        sql = sql[:-4]
-        print(sql)
-        return self.curs.execute(sql).fetchall()
+            term, term_params = self._get_term(key, kwargs[key])
+            terms.append(term)
+            params.extend(term_params)
+        if match:
+            terms.append('id IN (SELECT rowid FROM %s_fts WHERE %s_fts MATCH ?)'
+                         % (self.table, self.table))
+            params.append(match)
+        if not terms:
+            return '', params
+        return ' WHERE %s' % (' AND '.join(terms)), params
 
-    def add_record(self, record):
+    def _get_term(self, key, value):
+        """
+        Return a parameterized WHERE clause term for one search criterion, as
+        parsed by parse_criterion(), and a list of its parameters. Each term is
+        written so that an index on its column can serve it. A prefix on a TEXT
+        column is a case-insensitive range, which an index on the column with
+        NOCASE collation serves, and the range is then narrowed by LIKE.
+        """
+        operator, operands = parse_criterion(value)
+        if operator == '..':
+            low, high = operands
+            if low and high:
+                return '%s BETWEEN ? AND ?' % (key), [low, high]
+            if low:
+                return '%s >= ?' % (key), [low]
+            return '%s <= ?' % (key), [high]
+        if operator != '*':
+            return '%s %s ?' % (key, operator), operands
+        prefix = operands[0]
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%') \
+                        .replace('_', '\\_') + '%'
+        like = "%s LIKE ? ESCAPE '\\'" % (key)
+        if self._get_column_type(key) != 'TEXT':
+            return like, [pattern]
+        low = prefix.translate(ASCII_LOWER)
+        high = low[:-1] + chr(ord(low[-1]) + 1)
+        if 'A' <= high[-1] <= 'Z':
+            return '%s >= ? COLLATE NOCASE AND %s' % (key, like), [low, pattern]
+        return '%s >= ? COLLATE NOCASE AND %s < ? COLLATE NOCASE AND %s' % \
+                (key, key, like), [low, high, pattern]
+
+    def _get_column_type(self, name):
+        """Return the data-type of the named column."""
+        schema = self.get_schema()
+        return schema.types[schema.names.index(name)]
+
+    def _get_index_columns(self, **kwargs):
         """
-        Add a new database record.
+        Return the index columns that would serve the passed search criteria,
+        as a tuple. Columns matched exactly come first, then those matched by
+        range or by prefix, each group in name order. Criteria that no index
+        can serve are left out.
         """
-        sql = 'INSERT INTO %s VALUES (NULL' % (self.table)
-        for field in record:
-            sql += ', "%s"' % (field)
-        sql += ')'
-        print(sql)
+        exact = []
+        ranged = []
+        for key in sorted(kwargs):
+            if not kwargs[key]:
+                continue
+            operator = parse_criterion(kwargs[key])[0]
+            if operator == '=':
+                exact.append(key)
+            elif operator == '*':
+                if self._get_column_type(key) == 'TEXT':
+                    ranged.append('%s COLLATE NOCASE' % (key))
+            elif operator != '!=':
+                ranged.append(key)
+        return tuple(exact + ranged)
+
+    def _note_search(self, start, sql, params, **kwargs):
+        """
+        Record the time taken by a search that began at 'start', against the
+        combination of index columns that would serve it. When that combination
+        turns hot, and automatic indexing is on, index the columns unless the
+        search already avoids a full table scan. An index that fails to stop
+        the scan is dropped again.
+        """
+        columns = self._get_index_columns(**kwargs)
+        if not columns:
+            return
+        count, seconds = self.searches.get(columns, (0, 0, None, None))[:2]
+        count += 1
+        seconds += time.perf_counter() - start
+        self.searches[columns] = (count, seconds, sql, params)
+        if not self.auto_index or columns in self.indexed or \
+                count < HOT_SEARCH_COUNT or seconds / count < HOT_SEARCH_SECONDS:
+            return
+        """Creating an index would commit a transaction that is held open."""
+        if self.connections.hold:
+            return
+        self.indexed.add(columns)
+        if self._is_scan(sql, params):
+            name = self.create_index(*columns)
+            if self._is_scan(sql, params):
+                self.drop_index(name)
+
+    def get_index_advice(self):
+        """
+        Return a list of the hot combinations of index columns, each as a tuple
+        that may be passed on to create_index(), that no index yet serves.
+        """
+        advice = []
+        for columns, (count, seconds, sql, params) in self.searches.items():
+            if count < HOT_SEARCH_COUNT or seconds / count < HOT_SEARCH_SECONDS:
+                continue
+            if self._is_scan(sql, params):
+                advice.append(columns)
+        return advice
+
+    def get_indexes(self):
+        """
+        Return a list of the table's indexes, each as a tuple of the index name
+        and a tuple of its column names. Indexes that Sqlite creates itself
+        for constraints are not included.
+        """
+        return list(self.get_schema().indexes)
+
+    def _get_indexes(self):
+        """Read the table's indexes for get_indexes(), as a tuple."""
+        indexes = []
+        sql = 'PRAGMA index_list(%s)' % (self.table)
+        for index in self.curs.execute(sql).fetchall():
+            if index[3] != 'c':
+                continue
+            sql = 'PRAGMA index_info(%s)' % (index[1])
+            columns = self.curs.execute(sql).fetchall()
+            indexes.append((index[1], tuple(column[2] for column in columns)))
+        return tuple(indexes)
+
+    def create_index(self, *columns, unique=False):
+        """
+        Create an index on the passed columns, in the order passed, unless one
+        already exists. A column may be followed by a collation, as in 'title
+        COLLATE NOCASE'. A unique index is named apart from a plain index on
+        the same columns. Return the index name.
+        """
+        parts = [column.split() for column in columns]
+        self._check_columns(part[0] for part in parts)
+        for part in parts:
+            if len(part) > 1 and (len(part) != 3 or part[1].upper() != 'COLLATE'
+                                  or part[2].upper() not in COLLATIONS):
+                raise ValueError('invalid index column: %r' % (' '.join(part)))
+        name = '%s_%s_%s' % ('key' if unique else 'idx', self.table,
+                             '_'.join('_'.join(part[::2]).lower()
+                                      for part in parts))
+        sql = 'CREATE %sINDEX IF NOT EXISTS %s ON %s (%s)' % \
+                ('UNIQUE ' if unique else '', name, self.table,
+                 ', '.join(columns))
         self.curs.execute(sql)
         self.conn.commit()
+        self._reset_schema()
+        return name
 
-    def update_record(self, id, **kwargs):
+    def drop_index(self, name):
         """
-        Update change(s) into the database record that corresponds with the
-        passed 'id'.
-        """
-        sql = 'UPDATE %s SET (' % (self.table)
-        for key in kwargs:
-            sql += '%s, ' % (key)
-        sql = sql[:-2]
-        sql += ') = ('
-        for key in kwargs:
-            sql += '"%s", ' % (kwargs[key])
-        sql = sql[:-2]
-        sql += ') WHERE id=%s' % (id)
-        print(sql)
+        Drop the index with the passed name, if it exists.
+        """
+        sql = 'DROP INDEX IF EXISTS %s' % (name)
         self.curs.execute(sql)
         self.conn.commit()
+        self._reset_schema()
+
+    def create_text_index(self, columns=None):
+        """
+        Create a full-text index over the passed columns, which default to all
+        of the table's TEXT columns, and fill it from the table's records. The
+        index is an FTS5 table named '<table>_fts', which reads its content
+        from the table and is kept in step with it by triggers. Return the
+        indexed columns.
+        """
+        schema = self.get_schema()
+        if columns is None:
+            columns = [name for name, type in zip(schema.names, schema.types)
+                       if type == 'TEXT']
+        self._check_columns(columns)
+        self.drop_text_index()
+        if not columns:
+            return []
+        fts = '%s_fts' % (self.table)
+        names = ', '.join(columns)
+        new = ', '.join('new.%s' % (column) for column in columns)
+        old = ', '.join('old.%s' % (column) for column in columns)
+        insert = 'INSERT INTO %s (rowid, %s) VALUES (new.id, %s);' % \
+                (fts, names, new)
+        delete = "INSERT INTO %s (%s, rowid, %s) VALUES ('delete', old.id, %s);" \
+                % (fts, fts, names, old)
+        statements = [
+            "CREATE VIRTUAL TABLE %s USING fts5(%s, content='%s', "
+            "content_rowid='id')" % (fts, names, self.table),
+            "INSERT INTO %s (%s) VALUES ('rebuild')" % (fts, fts),
+            'CREATE TRIGGER %s_ai AFTER INSERT ON %s BEGIN %s END' % \
+                    (fts, self.table, insert),
+            'CREATE TRIGGER %s_ad AFTER DELETE ON %s BEGIN %s END' % \
+                    (fts, self.table, delete),
+            'CREATE TRIGGER %s_au AFTER UPDATE ON %s BEGIN %s %s END' % \
+                    (fts, self.table, delete, insert),
+        ]
+        for sql in statements:
+            self.curs.execute(sql)
+        self.conn.commit()
+        self._reset_schema()
+        return list(columns)
+
+    def drop_text_index(self):
+        """
+        Drop the table's full-text index and its triggers, if they exist.
+        """
+        fts = '%s_fts' % (self.table)
+        for sql in ('DROP TRIGGER IF EXISTS %s_ai' % (fts),
+                    'DROP TRIGGER IF EXISTS %s_ad' % (fts),
+                    'DROP TRIGGER IF EXISTS %s_au' % (fts),
+                    'DROP TABLE IF EXISTS %s' % (fts)):
+            self.curs.execute(sql)
+        self.conn.commit()
+        self._reset_schema()
+
+    def _get_text_columns(self):
+        """Read the columns of the table's full-text index for get_schema(), as
+        a tuple. The tuple is empty if there is no such index."""
+        sql = 'PRAGMA table_info(%s_fts)' % (self.table)
+        return tuple(column[1] for column in self.curs.execute(sql).fetchall())
+
+    def get_match_query(self, **kwargs):
+        """
+        Return a full-text query that matches each passed column against its
+        own full-text expression, such as 'pyth*' or '"core python"'. Columns
+        with empty expressions are ignored. Return None if there is nothing to
+        match.
+        """
+        self._check_columns(kwargs)
+        terms = ['%s : (%s)' % (key, kwargs[key]) for key in sorted(kwargs)
+                 if kwargs[key]]
+        return ' AND '.join(terms) or None
+
+    def explain(self, sql, params=()):
+        """
+        Return the query plan for the passed statement, as a list of the plan's
+        detail lines.
+        """
+        plan = self.curs.execute('EXPLAIN QUERY PLAN %s' % (sql), params)
+        return [row[3] for row in plan.fetchall()]
+
+    def _is_scan(self, sql, params):
+        """Return whether a statement's query plan scans the whole table."""
+        scan = 'SCAN %s' % (self.table)
+        return any(detail == scan or detail.startswith(scan + ' ')
+                   for detail in self.explain(sql, params))
+
+    def _check_columns(self, names):
+        """Raise ValueError if any of the passed names is not a column of the
+        table, since names can't be passed to Sqlite as parameters."""
+        columns = self.get_schema().names
+        for name in names:
+            if name not in columns:
+                raise ValueError('no such column in %s: %r' % (self.table, name))
+
+    def get_records(self, **kwargs):
+        """
+        Return a list of the database records that match the passed search
+        criteria.
+        """
+        where, params = self._get_criteria(**kwargs)
+        sql = 'SELECT * FROM %s%s' % (self.table, where)
+        return self._query(sql, params, criteria=kwargs)
+
+    def _query(self, sql, params=(), scalar=False, criteria=None, cache=True):
+        """
+        Return the list of records that a search statement selects, or its
+        single value when 'scalar' is set. A fresh result kept in the cache is
+        returned without running the statement. Otherwise the statement is run
+        and its result kept, and the search is noted against its 'criteria'.
+        When 'cache' is unset, then the cache is neither looked in nor kept
+        in. Lists are returned as copies, which the caller is free to change.
+        """
+        result = None
+        if cache:
+            key = (self.table, sql, tuple(params))
+            version = self.curs.execute('PRAGMA data_version').fetchone()[0]
+            stamp = (self.cache.get_generation(self.table), version)
+            result = self.cache.get(key, stamp)
+        if result is None:
+            start = time.perf_counter()
+            with self._timed():
+                self.curs.execute(sql, params)
+                result = self.curs.fetchone()[0] if scalar else \
+                        self.curs.fetchall()
+            self._note_search(start, sql, params, **(criteria or {}))
+            if not cache:
+                return result
+            self.cache.put(key, stamp, result)
+        return list(result) if isinstance(result, list) else result
+
+    def _timed(self):
+        """Return a context manager that times the statement run within a
+        'with' block, by the wall clock, while tracing is enabled."""
+        tracer = self.connections.tracer
+        return tracer.timing(self.conn) if tracer else nullcontext()
+
+    def add_record(self, record):
+        """
+        Add a new database record. Return the new record's id.
+        """
+        sql = self._get_insert_sql(len(record))
+        with self._timed():
+            self.curs.execute(sql, record)
+        self._commit()
+        return self.curs.lastrowid
+
+    def _get_insert_sql(self, count):
+        """Return the parameterized statement that inserts a record of 'count'
+        fields, with a new id."""
+        return 'INSERT INTO %s VALUES (NULL%s)' % (self.table, ', ?' * count)
+
+    def add_records(self, records, batch_size=BULK_BATCH_SIZE, verbose=True):
+        """
+        Add many new database records in bulk. Records are drawn from the
+        passed iterable in batches of 'batch_size' and inserted with a single
+        parameterized statement, all within one transaction. Return the count
+        of records added.
+        """
+        records = iter(records)
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return 0
+        sql = self._get_insert_sql(len(batch[0]))
+        self.cache.bump(self.table)
+        saved = self._set_pragmas(BULK_PRAGMAS)
+        count = 0
+        start = time.perf_counter()
+        try:
+            while batch:
+                with self._timed():
+                    self.curs.executemany(sql, batch)
+                count += len(batch)
+                if verbose:
+                    self._show_progress(count, start)
+                batch = list(islice(records, batch_size))
+            with self._timed():
+                self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+        finally:
+            self._set_pragmas(saved)
+        return count
+
+    def _set_pragmas(self, pragmas):
+        """
+        Apply each (name, value) pragma to the connection, where able. Return
+        the values that were in effect beforehand for the pragmas applied, in
+        the same form.
+        """
+        saved = []
+        for name, value in pragmas:
+            current = self.curs.execute('PRAGMA %s' % (name)).fetchone()[0]
+            try:
+                self.curs.execute('PRAGMA %s=%s' % (name, value))
+            except sqlite3.OperationalError:
+                """The journal mode can't leave WAL mode while other
+                connections are open, so the pragma is left as it is."""
+                continue
+            saved.append((name, current))
+        return saved
+
+    def _show_progress(self, count, start):
+        """Report the running total and rate of a bulk load."""
+        elapsed = time.perf_counter() - start
+        rate = count / elapsed if elapsed else 0
+        print('%d records loaded (%d rows/sec)' % (count, rate))
+
+    def merge_records(self, records, names, key, batch_size=BULK_BATCH_SIZE,
+                      verbose=True):
+        """
+        Bring the table into step with the passed records, which hold the
+        fields of the named columns, by their natural key of 'key' columns.
+        Each record's seed hash is compared with the one stored when it was
+        last merged, so that only new and changed records are written, by an
+        upsert on a unique index over the key columns. Records that were
+        merged before but are not passed now are deleted, as are all of the
+        records not passed to the first merge into a table. Writes are made
+        in batches of 'batch_size', each in its own transaction. Return the
+        counts of records inserted, updated, deleted and left unchanged. Raise
+        ValueError when two records have the same natural key.
+        """
+        """Column names are lower-cased when the table is created."""
+        names = [name.lower() for name in names]
+        key = [column.lower() for column in key]
+        self._check_columns(names)
+        for column in key:
+            if column not in names:
+                raise ValueError('key column not in seed data: %r' % (column))
+        positions = [names.index(column) for column in key]
+        """Results kept from before are stale from the first write on, and no
+        search is kept along the way."""
+        self.cache.bump(self.table)
+        self.create_index(*key, unique=True)
+        hashes = self._get_seed_hashes()
+        first = not hashes
+        counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        changes = self._get_changes(records, positions, hashes, counts)
+        upsert_sql = self._get_upsert_sql(names, key)
+        seed_sql = 'INSERT INTO %s (key, id, hash) SELECT ?, id, ? FROM %s ' \
+                   'WHERE %s ON CONFLICT (key) DO UPDATE SET id = ' \
+                   'excluded.id, hash = excluded.hash' % \
+                   (SEED_TABLE % (self.table), self.table,
+                    ' AND '.join('%s = ?' % (column) for column in key))
+        start = time.perf_counter()
+        count = 0
+        for batch in iter(lambda: list(islice(changes, batch_size)), []):
+            self._write_batch(
+                    (upsert_sql, [record for record, _, _ in batch]),
+                    (seed_sql, [[text, hash] + [record[i] for i in positions]
+                                for record, text, hash in batch]))
+            count += len(batch)
+            if verbose:
+                self._show_progress(count, start)
+        """Whatever keys are left over were not in the passed records."""
+        stale = list(hashes.items())
+        for i in range(0, len(stale), batch_size):
+            batch = stale[i:i + batch_size]
+            self._write_batch(
+                    ('DELETE FROM %s WHERE id = ?' % (self.table),
+                     [(id,) for text, (id, hash) in batch]),
+                    ('DELETE FROM %s WHERE key = ?' %
+                     (SEED_TABLE % (self.table)),
+                     [(text,) for text, _ in batch]))
+            counts['deleted'] += len(batch)
+        if first:
+            self._write_batch(
+                    ('DELETE FROM %s WHERE id NOT IN (SELECT id FROM %s)' %
+                     (self.table, SEED_TABLE % (self.table)), [()]))
+            counts['deleted'] += self.curs.rowcount
+        if verbose:
+            print('%(inserted)d records inserted, %(updated)d updated, '
+                  '%(deleted)d deleted, %(unchanged)d unchanged' % (counts))
+        return counts
+
+    def _write_batch(self, *statements):
+        """
+        Run each passed (sql, rows) statement with executemany(), and commit
+        them together, or else roll them all back. Each statement, and the
+        commit, is timed while tracing is enabled.
+        """
+        try:
+            for sql, rows in statements:
+                with self._timed():
+                    self.curs.executemany(sql, rows)
+            with self._timed():
+                self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+
+    def _get_seed_hashes(self):
+        """
+        Return a dictionary of each merged record's natural key, as text, to
+        its id and seed hash. The seed hash table is created if need be.
+        """
+        seed_table = SEED_TABLE % (self.table)
+        with self.conn:
+            self.curs.execute('CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY '
+                              'KEY, id INTEGER, hash INTEGER) WITHOUT ROWID' %
+                              (seed_table))
+        sql = 'SELECT key, id, hash FROM %s' % (seed_table)
+        return {text: (id, hash) for text, id, hash in self.curs.execute(sql)}
+
+    def _get_changes(self, records, positions, hashes, counts):
+        """
+        Yield each passed record that is new or changed, along with its natural
+        key as text and its seed hash. Each record's key is taken out of
+        'hashes' as it is seen, and 'counts' is kept up to date. Raise
+        ValueError on a record with a NULL key field, or with the same key as
+        an earlier record.
+        """
+        seen = set()
+        for record in records:
+            """A NULL key field would never match on the upsert."""
+            if any(record[i] is None for i in positions):
+                raise ValueError('seed record has a null key field: %s' %
+                                 (', '.join(map(repr, record))))
+            text = join_fields(record[i] for i in positions)
+            """A second record with a key would overwrite the first one."""
+            if text in seen:
+                raise ValueError('duplicate key in seed data: %s' %
+                                 (', '.join(repr(record[i])
+                                            for i in positions)))
+            seen.add(text)
+            hash = get_row_hash(record)
+            id, old = hashes.pop(text, (None, None))
+            if id is None:
+                counts['inserted'] += 1
+            elif old == hash:
+                counts['unchanged'] += 1
+                continue
+            else:
+                counts['updated'] += 1
+            yield record, text, hash
+
+    def _get_upsert_sql(self, names, key):
+        """Return the parameterized statement that inserts a record of the
+        named columns, or updates the record that has the same natural key."""
+        values = [name for name in names if name not in key]
+        action = 'UPDATE SET %s' % (', '.join(
+                '%s = excluded.%s' % (name, name) for name in values)) \
+                if values else 'NOTHING'
+        return 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO %s' % \
+                (self.table, ', '.join(names), ', '.join('?' * len(names)),
+                 ', '.join(key), action)
+
+    def update_record(self, id, **kwargs):
+        """
+        Update change(s) into the database record that corresponds with the
+        passed 'id'. Return the updated record.
+        """
+        self._check_columns(kwargs)
+        keys = sorted(kwargs)
+        sql = 'UPDATE %s SET %s WHERE id = ?' % \
+                (self.table, ', '.join('%s = ?' % (key) for key in keys))
+        with self._timed():
+            self.curs.execute(sql, [kwargs[key] for key in keys] + [id])
+        self._commit()
+        return self.get_record(id)
+
+    def update_records(self, ids, **kwargs):
+        """
+        Update the same change(s) into each database record whose id is among
+        the passed 'ids', with a single parameterized statement, in one
+        transaction. Return the count of records updated.
+        """
+        self._check_columns(kwargs)
+        keys = sorted(kwargs)
+        sql = 'UPDATE %s SET %s WHERE id = ?' % \
+                (self.table, ', '.join('%s = ?' % (key) for key in keys))
+        values = [kwargs[key] for key in keys]
+        with self._timed():
+            self.curs.executemany(sql, [values + [id] for id in ids])
+        self._commit()
+        return self.curs.rowcount
+
+    def update_matching(self, criteria, **kwargs):
+        """
+        Update the same change(s) into each database record that matches the
+        passed search criteria, a dictionary of them as get_records() takes,
+        with a single statement, so that the records need not be read first.
+        With no criteria, every record is updated. Return the count of records
+        updated.
+        """
+        self._check_columns(kwargs)
+        where, params = self._get_criteria(**criteria)
+        keys = sorted(kwargs)
+        sql = 'UPDATE %s SET %s%s' % \
+                (self.table, ', '.join('%s = ?' % (key) for key in keys), where)
+        with self._timed():
+            self.curs.execute(sql, [kwargs[key] for key in keys] + params)
+        self._commit()
+        return self.curs.rowcount
 
     def delete_record(self, id):
         """
         Delete the database record that corresponds with the passed 'id'.
+        Return that id.
         """
-        sql = 'DELETE FROM %s WHERE id=%s' % (self.table, id)
-        print(sql)
-        self.curs.execute(sql)
-        self.conn.commit()
+        sql = 'DELETE FROM %s WHERE id = ?' % (self.table)
+        with self._timed():
+            self.curs.execute(sql, (id,))
+        self._commit()
+        return id
+
+    def delete_records(self, ids):
+        """
+        Delete each database record whose id is among the passed 'ids', with a
+        single parameterized statement, in one transaction. Return the count
+        of records deleted.
+        """
+        sql = 'DELETE FROM %s WHERE id = ?' % (self.table)
+        with self._timed():
+            self.curs.executemany(sql, [(id,) for id in ids])
+        self._commit()
+        return self.curs.rowcount
+
+    def delete_matching(self, criteria):
+        """
+        Delete each database record that matches the passed search criteria,
+        a dictionary of them as get_records() takes, with a single statement.
+        With no criteria, every record is deleted. Return the count of records
+        deleted.
+        """
+        where, params = self._get_criteria(**criteria)
+        sql = 'DELETE FROM %s%s' % (self.table, where)
+        with self._timed():
+            self.curs.execute(sql, params)
+        self._commit()
+        return self.curs.rowcount
+
+    def _commit(self):
+        """Start a new write generation for the table, after a record edit, and
+        commit the edit, unless its transaction is being held open."""
+        self.cache.bump(self.table)
+        if not self.connections.hold:
+            with self._timed():
+                self.conn.commit()
 
     def close(self):
         """
-        Close the connection to the database.
+        Close the connections to the database, unless this is a handle from
+        get_table().
         """
-        self.conn.close()
+        if self.owner:
+            self.connections.close()
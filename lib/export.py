@@ -0,0 +1,274 @@
+# export.py v0.1                                                  -*- Python -*-
+
+# Write the records of an sqlite database-table out to a file, as they stream.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import json
+import struct
+import sys
+from array import array
+from itertools import accumulate
+
+EXPORT_BATCH_SIZE = 10000
+
+"""The columnar file format. A file begins with COLUMNAR_MAGIC, and then a
+header, and then a chunk for each COLUMNAR_CHUNK_ROWS records. The header and
+each chunk's stats are JSON, each preceded by its length in bytes as a 4-byte
+unsigned integer. The chunk's stats list each column's kind of data, null
+count, min and max values, and payload size, and then the column payloads
+follow in column order. A payload begins with a bitmap of the non-null rows,
+unless the column has no nulls. It then holds an array of the narrowest
+integers that fit the column's values, of kind 'b', 'h', 'i' or 'q', or of
+floats, of kind 'd'. Otherwise, a text column of kind 's' holds an array of
+row+1 offsets into the UTF-8 text that follows it, and the kind of the offset
+array is in the stats. The header's byteorder is that of the arrays."""
+COLUMNAR_MAGIC = b'DBCOL\x01'
+COLUMNAR_CHUNK_ROWS = 65536
+INT_KINDS = ('b', 'h', 'i', 'q')
+
+def export_table(db, file, format='csv', batch_size=EXPORT_BATCH_SIZE,
+                 **kwargs):
+    """
+    Write the table's records that match the passed search criteria, or all of
+    them, to an open file in the passed format. Records are read in batches by
+    keyset pagination on 'id', or by offset through the ranked matches of a
+    full-text query, so that memory use is bounded and no read stays open
+    across the whole export. Return the count of records written.
+    """
+    records = iter_table(db, batch_size=batch_size, **kwargs)
+    return WRITERS[format](file, db.get_column_names(pkey=True), records)
+
+def iter_table(db, batch_size=EXPORT_BATCH_SIZE, **kwargs):
+    """
+    Yield the table's records that match the passed search criteria, in 'id'
+    order, as read in batches of 'batch_size'. The records that match a
+    full-text query 'match' are ranked instead, and so are paged through by
+    offset, as get_page() does not use 'after' for them. Each batch is read
+    just once, and so is not kept in the Database's ResultCache.
+    """
+    batch = db.get_page(limit=batch_size, cache=False, **kwargs)
+    offset = 0
+    while batch:
+        yield from batch
+        if len(batch) < batch_size:
+            break
+        offset += len(batch)
+        after = None if kwargs.get('match') else batch[-1][0]
+        batch = db.get_page(after=after, offset=offset, limit=batch_size,
+                            cache=False, **kwargs)
+
+def write_csv(file, names, records):
+    """
+    Write a header line of column names, and then each record, to an open
+    text file in csv format. Return the count of records written.
+    """
+    writer = csv.writer(file)
+    writer.writerow(names)
+    count = 0
+    for record in records:
+        writer.writerow(record)
+        count += 1
+    return count
+
+def write_json(file, names, records):
+    """
+    Write each record to an open text file as one line of JSON, that being an
+    object keyed by column name. Return the count of records written.
+    """
+    count = 0
+    for record in records:
+        file.write(json.dumps(dict(zip(names, record))))
+        file.write('\n')
+        count += 1
+    return count
+
+def write_columnar(file, names, records, chunk_rows=COLUMNAR_CHUNK_ROWS):
+    """
+    Write the records to an open file in the columnar format, in chunks of
+    'chunk_rows' records. A text file is written to through its underlying
+    binary buffer. Return the count of records written.
+    """
+    file = getattr(file, 'buffer', file)
+    file.write(COLUMNAR_MAGIC)
+    _write_json(file, {'columns': list(names), 'byteorder': sys.byteorder})
+    records = iter(records)
+    count = 0
+    while True:
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == chunk_rows:
+                break
+        if not chunk:
+            break
+        stats = []
+        payloads = []
+        for values in zip(*chunk):
+            column, payload = _encode_column(values)
+            stats.append(column)
+            payloads.append(payload)
+        _write_json(file, {'rows': len(chunk), 'columns': stats})
+        for payload in payloads:
+            file.write(payload)
+        count += len(chunk)
+    return count
+
+def _write_json(file, value):
+    """Write a value as JSON, preceded by its length."""
+    data = json.dumps(value).encode()
+    file.write(struct.pack('<I', len(data)))
+    file.write(data)
+
+def _encode_column(values):
+    """
+    Return the stats and the payload for one column's values within a chunk.
+    The column is stored as integers if every non-null value is an integer
+    that fits 8 bytes, as floats if every one is a number and some are floats,
+    and else as text.
+    """
+    present = [value for value in values if value is not None]
+    nulls = len(values) - len(present)
+    stats = {}
+    integers = all(type(value) is int for value in present)
+    if integers:
+        low = min(present, default=0)
+        high = max(present, default=0)
+        for kind in INT_KINDS:
+            bits = array(kind).itemsize * 8 - 1
+            if -2 ** bits <= low and high < 2 ** bits:
+                data = array(kind, [0 if value is None else value
+                                    for value in values]).tobytes()
+                break
+        else:
+            kind = None
+    else:
+        kind = None
+    if kind is None and not integers and \
+            all(type(value) in (int, float) for value in present):
+        kind = 'd'
+        present = [float(value) for value in present]
+        data = array(kind, [0.0 if value is None else value
+                            for value in values]).tobytes()
+    elif kind is None:
+        kind = 's'
+        present = [str(value) for value in present]
+        text = [b'' if value is None else str(value).encode()
+                for value in values]
+        offsets = array('Q', accumulate((len(value) for value in text),
+                                        initial=0))
+        if offsets[-1] < 2 ** 32:
+            offsets = array('I', offsets)
+        stats['offsets'] = offsets.typecode
+        data = offsets.tobytes() + b''.join(text)
+    payload = _encode_bitmap(values) if nulls else b''
+    payload += data
+    stats.update({
+        'kind': kind,
+        'nulls': nulls,
+        'min': min(present) if present else None,
+        'max': max(present) if present else None,
+        'size': len(payload),
+    })
+    return stats, payload
+
+def _encode_bitmap(values):
+    """Return a bitmap with a set bit for each non-null value."""
+    bitmap = bytearray((len(values) + 7) // 8)
+    for i, value in enumerate(values):
+        if value is not None:
+            bitmap[i >> 3] |= 1 << (i & 7)
+    return bytes(bitmap)
+
+def read_columnar(file, want=None):
+    """
+    Yield each record of an open columnar file, as a tuple. When a 'want'
+    function is passed, then only the records of chunks for which want(stats)
+    is true are yielded.
+    """
+    names, chunks = read_columnar_chunks(file, want=want)
+    for stats, columns in chunks:
+        yield from zip(*columns)
+
+def read_columnar_chunks(file, want=None):
+    """
+    Read the header of an open columnar file. Return its column names, and an
+    iterator that yields the stats of each chunk, along with a list of the
+    values of each column. When a 'want' function is passed, then each chunk
+    for which want(stats) is false is passed over without being decoded.
+    """
+    file = getattr(file, 'buffer', file)
+    if file.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError('not a columnar file')
+    header = _read_json(file)
+    return header['columns'], _read_chunks(file, want,
+                                           header['byteorder'] != sys.byteorder)
+
+def _read_chunks(file, want, swap):
+    """Yield the stats and column values of each chunk in a columnar file."""
+    while True:
+        stats = _read_json(file)
+        if stats is None:
+            break
+        if want and not want(stats):
+            file.read(sum(column['size'] for column in stats['columns']))
+            continue
+        columns = [_decode_column(file.read(column['size']), column,
+                                  stats['rows'], swap)
+                   for column in stats['columns']]
+        yield stats, columns
+
+def _read_json(file):
+    """Read a value written by _write_json(), or return None at the end."""
+    size = file.read(4)
+    if not size:
+        return None
+    return json.loads(file.read(struct.unpack('<I', size)[0]))
+
+def _decode_column(payload, column, rows, swap):
+    """Return the list of one column's values within a chunk."""
+    bitmap = None
+    if column['nulls']:
+        bitmap = payload[:(rows + 7) // 8]
+        payload = payload[len(bitmap):]
+    if column['kind'] == 's':
+        offsets = array(column['offsets'])
+        size = (rows + 1) * offsets.itemsize
+        offsets.frombytes(payload[:size])
+        if swap:
+            offsets.byteswap()
+        text = payload[size:]
+        values = [text[offsets[i]:offsets[i + 1]].decode()
+                  for i in range(rows)]
+    else:
+        data = array(column['kind'])
+        data.frombytes(payload)
+        if swap:
+            data.byteswap()
+        values = data.tolist()
+    if bitmap is not None:
+        for i in range(rows):
+            if not bitmap[i >> 3] & (1 << (i & 7)):
+                values[i] = None
+    return values
+
+"""The record writers, by output format name."""
+WRITERS = {
+    'csv': write_csv,
+    'json': write_json,
+    'columnar': write_columnar,
+}
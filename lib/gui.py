@@ -0,0 +1,563 @@
+# gui.py v0.1                                                     -*- Python -*-
+
+# Provide a Tk user interface that administers an sqlite database-table.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import tkinter as tk
+from tkinter import messagebox
+from .db import Database
+from .journal import EditJournal
+from .pager import Pager, prefetch
+from .worker import QueryWorker
+
+"""Held edits are saved this long after the first of them, if not before."""
+FLUSH_MS = 30000
+
+"""Event state bits of the keyboard modifiers that extend a selection."""
+SHIFT_MASK = 0x1
+CONTROL_MASK = 0x4
+
+################################################################################
+class UserInterface():
+    """
+    UserInterface creates and places Tk form elements according to the caller's
+    specification. These elements consists of a flexible count of entry elements
+    with associated label elements, a listbox element with scrollbar attached,
+    and buttons that interface with whichever database is associated with the
+    caller. The listbox's rows are read in the background, through the
+    caller's fetch(func, *args, callback=callback), which runs the job
+    func(db, *args) and passes its result to callback().
+    """
+    def __init__(self, window, fields, buttons, fetch, tables=None,
+                 on_table=None):
+        self.fields = fields
+        self.window = window
+        self.fetch = fetch
+        self.lbl = {}
+        self.ent = {}
+        self.btn = {}
+        self.slots = []
+        self.form = None
+        self.table = None
+        self.lst = None
+        self.scr = None
+        self.records = None
+        self.total = 0
+        self.visible = []
+        self.top = 0
+        self.selected = None
+        self.selection = {}
+        self.selected_all = False
+        self.col = 0
+        self.row = 0
+        """Add a table switcher when there is more than one table, then the
+        data-entry fields, a listbox with scrollbar, and the buttons to the
+        user interface."""
+        if tables and len(tables) > 1:
+            self.add_switcher(tables=tables, command=on_table)
+        self.add_form()
+        self.set_fields(fields)
+        self.add_list()
+        for i in range(len(buttons)):
+            self.add_button(name=buttons[i][0], command=buttons[i][1])
+
+    def add_switcher(self, tables, command):
+        """Add a labelled menu of table names, which calls command(name)."""
+        label = tk.Label(master=self.window, text='Table: ', height=2,
+                         width=12, anchor=tk.E)
+        label.grid(row=self.row, column=0)
+        self.table = tk.StringVar(master=self.window, value=tables[0])
+        menu = tk.OptionMenu(self.window, self.table, *tables,
+                             command=command)
+        menu.grid(row=self.row, column=1, sticky=tk.W)
+        self.row += 1
+
+    def add_form(self):
+        """Add a frame to hold the data-entry fields."""
+        self.form = tk.Frame(master=self.window)
+        self.form.grid(row=self.row, column=0, columnspan=4)
+
+    def set_fields(self, fields, field_break=2):
+        """
+        Show a data-entry field for each of the passed names, by relabelling
+        the fields that are already in the form and adding any more that are
+        needed. Fields left over are hidden rather than destroyed, so that a
+        switch between tables does not rebuild the form.
+        """
+        self.fields = fields
+        self.lbl = {}
+        self.ent = {}
+        self.selected = None
+        for i, name in enumerate(fields):
+            if i == len(self.slots):
+                self.add_field(field_break=field_break)
+            label, entry = self.slots[i]
+            label.configure(text='%s: ' % (name.replace('_', ' ').title()))
+            label.grid()
+            entry.delete(0, tk.END)
+            entry.grid()
+            self.lbl[name] = label
+            self.ent[name] = entry
+        for label, entry in self.slots[len(fields):]:
+            label.grid_remove()
+            entry.grid_remove()
+
+    def add_field(self, field_break=2):
+        """Add a label element for a field to the form."""
+        row, col = divmod(len(self.slots), field_break)
+        label = tk.Label(master=self.form, height=2, width=12, anchor=tk.E)
+        label.grid(row=row, column=col * 2)
+        """Add an entry element for the field."""
+        entry = tk.Entry(master=self.form, textvariable=tk.StringVar(),
+                         width=16)
+        entry.grid(row=row, column=col * 2 + 1)
+        self.slots.append((label, entry))
+
+    def add_list(self):
+        self.row += 1
+        self.col = 0
+        """Add a listbox element. Its selection is not exported as the X
+        selection, which a selection of text in an entry element would
+        otherwise clear."""
+        listbox = tk.Listbox(master=self.window, width=28,
+                             selectmode=tk.EXTENDED, exportselection=False)
+        listbox.grid(row=self.row, column=self.col, rowspan=6, columnspan=2,
+                 sticky=tk.E)
+        self.col += 2
+        """Add a scrollbar element."""
+        scrollbar = tk.Scrollbar(master=self.window)
+        scrollbar.grid(row=self.row, column=self.col, rowspan=6, sticky=tk.W)
+        """Let the scrollbar and the mouse wheel scroll the listbox. The listbox
+        only ever holds the visible rows, so scrolling is done here rather than
+        by the listbox itself. Bind to a click event within the listbox, and
+        to Control-A, which selects every record."""
+        scrollbar.configure(command=self.scroll_list)
+        listbox.bind(sequence='<MouseWheel>', func=self.wheel_list)
+        listbox.bind(sequence='<Button-4>', func=self.wheel_list)
+        listbox.bind(sequence='<Button-5>', func=self.wheel_list)
+        listbox.bind(sequence='<<ListboxSelect>>', func=self.get_selected)
+        listbox.bind(sequence='<ButtonPress-1>', func=self.click_list)
+        listbox.bind(sequence='<Control-a>', func=self.select_all)
+        self.col += 1
+        self.lst = listbox
+        self.scr = scrollbar
+
+    def add_button(self, name, command):
+        """Add a button element."""
+        name = name.replace('_', ' ').title()
+        button = tk.Button(master=self.window, text=name, width='12',
+                           command=command)
+        button.grid(row=self.row, column=self.col, sticky=tk.E)
+        self.row += 1
+        self.btn[name] = button
+
+    def show_records(self, records):
+        """
+        Display a sequence of records in the listbox, scrolled to the top. The
+        sequence need only support len() and get_records(first, count), since
+        just the visible rows are ever fetched from it, by a background job.
+        """
+        self.records = records
+        self.top = 0
+        self.selection = {}
+        self.selected_all = False
+        self.draw_list()
+
+    def draw_list(self):
+        """Fetch the visible rows in the background, and then fill the listbox
+        with them."""
+        height = int(self.lst.cget('height'))
+        self.fetch(_get_rows, self.records, self.top, height,
+                   callback=self.fill_list)
+
+    def fill_list(self, result):
+        """Fill the listbox with the visible rows, and update the scrollbar."""
+        self.top, total, self.visible = result
+        self.total = total
+        height = int(self.lst.cget('height'))
+        self.lst.delete(0, tk.END)
+        for i, record in enumerate(self.visible):
+            self.lst.insert(tk.END, record)
+            if self.selected_all or record[0] in self.selection or \
+                    self.selected and record[0] == self.selected[0]:
+                self.lst.selection_set(i)
+        if total:
+            self.scr.set(self.top / total, min(1, (self.top + height) / total))
+        else:
+            self.scr.set(0, 1)
+
+    def scroll_list(self, action, amount, unit=None):
+        """Scroll the listbox in response to the scrollbar."""
+        if action == 'moveto':
+            self.top = int(float(amount) * self.total)
+        elif unit == 'pages':
+            self.top += int(amount) * int(self.lst.cget('height'))
+        else:
+            self.top += int(amount)
+        self.draw_list()
+
+    def wheel_list(self, event):
+        """Scroll the listbox in response to the mouse wheel."""
+        if event.num == 4 or event.delta > 0:
+            self.scroll_list('scroll', -3, 'units')
+        else:
+            self.scroll_list('scroll', 3, 'units')
+        return 'break'
+
+    def refresh_records(self, changes, moved):
+        """
+        Patch the listbox after a change to some records, as found by a
+        background job: the changed records at hand, by id, each None if no
+        longer among the records, and whether the positions of the records
+        have shifted. A record that keeps its place has just its own entry
+        redrawn. Otherwise, the visible rows are fetched anew from the same
+        scroll position.
+        """
+        for id, record in changes.items():
+            if self.selected and self.selected[0] == id:
+                self.selected = record
+            if id in self.selection:
+                if record:
+                    self.selection[id] = record
+                else:
+                    del self.selection[id]
+        if moved:
+            self.draw_list()
+            return
+        for i, visible in enumerate(self.visible):
+            id = visible[0]
+            if not changes.get(id):
+                continue
+            self.visible[i] = changes[id]
+            self.lst.delete(i)
+            self.lst.insert(i, changes[id])
+            if self.selected_all or id in self.selection or \
+                    self.selected and self.selected[0] == id:
+                self.lst.selection_set(i)
+
+    def click_list(self, event):
+        """Start a new selection upon a click without Shift or Control."""
+        if not event.state & (SHIFT_MASK | CONTROL_MASK):
+            self.selection = {}
+            self.selected_all = False
+
+    def select_all(self, event):
+        """Select every record in the listbox, scrolled into view or not. The
+        records are not read, as the selection stands for every record that
+        matches the shown records' search criteria."""
+        if self.records is not None:
+            self.selection = {}
+            self.selected_all = True
+            self.draw_list()
+        return 'break'
+
+    def get_selection(self):
+        """Return a list of the ids of the selected records, or None when every
+        record is selected."""
+        if self.selected_all:
+            return None
+        if self.selection:
+            return list(self.selection)
+        return [self.selected[0]] if self.selected else []
+
+    def get_selected(self, event):
+        """Determine which members in the listbox have been selected, if any.
+        The first of them populates the entry elements."""
+        indexes = self.lst.curselection()
+        self.selected_all = False
+        for index, record in enumerate(self.visible):
+            if index in indexes:
+                self.selection[record[0]] = record
+            else:
+                self.selection.pop(record[0], None)
+        try:
+            i = 0
+            index = indexes[i]
+            self.selected = self.visible[index]
+            """Populate the entry elements with the selected member's data."""
+            for field in self.fields:
+                i += 1
+                self.ent[field].delete(0, tk.END)
+                self.ent[field].insert(tk.END, self.selected[i])
+        except IndexError:
+            return
+
+################################################################################
+class Window():
+    """
+    Window generates a GUI interface via the UserInterface class and interfaces
+    with an Sqlite database via the Database class. When the database has more
+    than one table, then any of them may be switched to, beginning with the
+    passed table, if any. Edits are held in an EditJournal, from which they
+    may be undone, until they are saved together. The journal holds them on
+    the background worker's connection, where they are made, undone and saved
+    by jobs, so that the window neither waits on the database's write lock
+    nor on a commit, and where the searches and the listbox's reads see them.
+    """
+    def __init__(self, window, title, db, table=None):
+        self.window = window
+        self.window.wm_title(string=title)
+        self.home = db
+        self.db = db.get_table(table) if table else db
+        tables = db.get_tables()
+        if self.db.table in tables:
+            tables.remove(self.db.table)
+            tables.insert(0, self.db.table)
+        """Build the data-entry field list from the database-table column
+        names."""
+        fields = []
+        for column in self.db.get_column_names():
+            fields.append(column)
+        """Build the button element list."""
+        buttons = [
+            ('view_all', self.view_collection),
+            ('search', self.search_collection),
+            ('text_search', self.match_collection),
+            ('add_new', self.add_item),
+            ('update', self.update_item),
+            ('delete', self.delete_item),
+            ('undo', self.undo_edit),
+            ('save', self.save_edits),
+            ('close', self.close_window)
+        ]
+        """Initialize the user interface. Database jobs run in the background,
+        so that the window stays responsive while they do."""
+        self.worker = QueryWorker(window=self.window, path=db.path,
+                                  name=db.table, on_busy=self.show_busy)
+        self.ui = UserInterface(self.window, fields, buttons, fetch=self.fetch,
+                                tables=tables, on_table=self.switch_table)
+        self.journal = EditJournal(self.worker.db)
+        self.flush_job = None
+        """Closing the window from its title bar saves the held edits too,
+        which would otherwise be lost with the worker's connection."""
+        self.window.protocol('WM_DELETE_WINDOW', self.close_window)
+        self.view_collection()
+
+    def switch_table(self, name):
+        """Display the fields and records of another table in the database.
+        The form is relabelled in place, and the table's handle is kept for
+        when it is next switched to."""
+        self.db = self.home.get_table(name)
+        self.ui.set_fields(self.db.get_column_names())
+        self.view_collection()
+
+    def submit(self, func, *args, **kwargs):
+        """Run a database job in the background, against the shown table."""
+        self.worker.submit(func, *args, table=self.db.table, **kwargs)
+
+    def fetch(self, func, *args, **kwargs):
+        """Run a job that reads the listbox's rows in the background. A read
+        that is still running is superseded by the next."""
+        self.worker.submit(func, *args, key='rows', **kwargs)
+
+    def show_busy(self, busy):
+        """Show a busy cursor while database jobs are running."""
+        self.window.configure(cursor='watch' if busy else '')
+
+    def view_collection(self):
+        """Display all records in the database table."""
+        self.submit(_get_pager, {}, key='records',
+                    callback=self.ui.show_records)
+
+    def search_collection(self):
+        """From the database table, search for all records that conform to
+        specified search criteria. Besides exact values, a field may hold a
+        comparison such as '>=1970' or '!=x', a range such as '1970..1980', or
+        a prefix such as 'Led*'. A search that is still running is interrupted
+        by the next search."""
+        val = {}
+        for name in self.db.get_column_names():
+            val[name] = self.ui.ent[name].get()
+        self.submit(_get_pager, val, key='records',
+                    callback=self.ui.show_records)
+
+    def match_collection(self):
+        """From the database table, search for all records whose text matches
+        full-text expressions such as 'pyth*' or '"core python"', ranked best
+        match first. The full-text index is built first, if there is none.
+        Fields that are not full-text indexed are searched as by Search."""
+        text_columns = self.db.get_schema().text_columns
+        if not text_columns:
+            """Creating the index commits, and so the held edits are saved
+            first."""
+            self.save_edits()
+            self.submit(Database.create_text_index, errback=self.show_error)
+            text_columns = [name for name, type in
+                            zip(self.db.get_column_names(),
+                                self.db.get_column_types()) if type == 'TEXT']
+        text = {}
+        val = {}
+        for name in self.db.get_column_names():
+            if name in text_columns:
+                text[name] = self.ui.ent[name].get()
+            else:
+                val[name] = self.ui.ent[name].get()
+        val['match'] = self.db.get_match_query(**text)
+        self.submit(_get_pager, val, key='records',
+                    callback=self.ui.show_records, errback=self.show_error)
+
+    def show_error(self, error):
+        """Report a failed database job."""
+        messagebox.showerror(title='Error', message=str(error))
+
+    def add_item(self):
+        """Add a record to the database table."""
+        record = []
+        for name in self.db.get_column_names():
+            field = self.ui.ent[name].get()
+            if not field:
+                return
+            record.append(field)
+        self.edit(self.journal.add, record=record)
+
+    def update_item(self):
+        """Update with changes the selected record(s) in the database table. A
+        single record is updated with every field. Several records are each
+        updated with just the filled-in fields that differ from the first
+        selected record. When every record is selected, then those that match
+        the shown records' search criteria are updated with one statement."""
+        ids = self.ui.get_selection()
+        if ids == []:
+            return
+        single = ids is not None and len(ids) == 1
+        val = {}
+        for i, name in enumerate(self.db.get_column_names()):
+            val[name] = self.ui.ent[name].get()
+            if single and not val[name]:
+                return
+            if not single and (not val[name] or self.ui.selected and
+                               val[name] == str(self.ui.selected[i + 1])):
+                del val[name]
+        if not val:
+            return
+        if ids is None:
+            self.edit(self.journal.update_matching,
+                      criteria=self.ui.records.criteria, **val)
+        else:
+            self.edit(self.journal.update, ids=ids, **val)
+
+    def delete_item(self):
+        """Delete the selected record(s) from the database table. When every
+        record is selected, then those that match the shown records' search
+        criteria are deleted with one statement."""
+        ids = self.ui.get_selection()
+        if ids is None:
+            self.edit(self.journal.delete_matching,
+                      criteria=self.ui.records.criteria)
+        elif ids:
+            self.edit(self.journal.delete, ids=ids)
+
+    def edit(self, func, **kwargs):
+        """
+        Make an edit through the journal in the background, which holds it
+        until it is saved, and patch the listbox to show it. Saving is
+        scheduled for FLUSH_MS after the first edit that is held.
+        """
+        def callback(result):
+            if self.flush_job is None:
+                self.flush_job = self.window.after(FLUSH_MS, self.save_edits)
+            self.ui.refresh_records(*result)
+        self.submit(_edit, func, kwargs, self.ui.records, self.get_selected(),
+                    callback=callback, errback=self.show_error)
+
+    def undo_edit(self):
+        """Undo the latest edit that has not yet been saved."""
+        def callback(result):
+            self.ui.refresh_records(*result)
+        self.submit(_undo, self.journal, self.ui.records, self.get_selected(),
+                    callback=callback, errback=self.show_error)
+
+    def get_selected(self):
+        """Return the id of the record shown in the entry elements, if any."""
+        return self.ui.selected[0] if self.ui.selected else None
+
+    def save_edits(self):
+        """Save every held edit in the background, with a single commit."""
+        if self.flush_job is not None:
+            self.window.after_cancel(self.flush_job)
+            self.flush_job = None
+        self.worker.submit(_flush, self.journal, errback=self.show_error)
+
+    def close_window(self):
+        """Save any held edits, and then close the window once the background
+        jobs are done. An error in saving is reported before it closes."""
+        self.save_edits()
+        self.worker.close()
+        self.worker.poll()
+        self.window.quit()
+
+"""The jobs that read or edit the shown records, each run as func(db, *args)
+on the worker thread, where the shown records' Pager reads through the same
+connection that holds the edits."""
+def _get_pager(db, criteria):
+    """Return a Pager over the records that match the passed search criteria,
+    with its count and first page fetched."""
+    count, first_page = prefetch(db, **criteria)
+    return Pager(db=db, count=count, first_page=first_page, **criteria)
+
+def _get_rows(db, records, first, count):
+    """
+    Return the position of the first of up to 'count' records read from a
+    sequence of them, the length of the sequence, and a list of the records
+    read. The first position asked for is moved back as far as is needed to
+    read 'count' records, if the sequence is long enough.
+    """
+    total = len(records)
+    first = max(0, min(first, total - count))
+    return first, total, records.get_records(first, count) if total else []
+
+def _edit(db, func, kwargs, records, selected):
+    """
+    Make an edit by func(db, **kwargs), one of the EditJournal's, and bring
+    the Pager of the shown records up to date with it. Return the changes to
+    the shown records, as from _refresh().
+    """
+    ids = func(db, **kwargs)
+    if isinstance(ids, int):
+        ids = [ids]
+    return _refresh(db, records, ids, selected)
+
+def _undo(db, journal, records, selected):
+    """Undo the latest held edit, and bring the Pager of the shown records up
+    to date with it. Return the changes to them, as from _refresh()."""
+    edit = journal.undo()
+    if edit is None or edit.table != db.table:
+        return {}, False
+    return _refresh(db, records, edit.ids, selected)
+
+def _flush(db, journal):
+    """Save every held edit. Return the count of edits saved."""
+    return journal.flush()
+
+def _refresh(db, records, ids, selected):
+    """
+    Bring the Pager of the shown records up to date after a change to the
+    records with the passed ids, or with ids None, after a change to records
+    whose ids are unknown. Return the changed records at hand, by id, each
+    None if no longer shown, and whether the positions of the shown records
+    have shifted. A change to more than one record reloads the records
+    instead, and only the selected record is looked up anew.
+    """
+    if records is None or records.db.table != db.table:
+        return {}, False
+    if ids is not None and len(ids) == 1:
+        record, moved = records.refresh_record(ids[0])
+        return {ids[0]: record}, moved
+    records.reload()
+    if selected is not None and (ids is None or selected in ids):
+        return {selected: db.get_record(selected)}, True
+    return {}, True
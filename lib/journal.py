@@ -0,0 +1,123 @@
+# journal.py v0.1                                                 -*- Python -*-
+
+# Collect edits to sqlite database-tables into one transaction, with undo.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+from itertools import count
+
+"""An edit held by the journal: its savepoint's name, the name of the table
+that it changed, and the ids of the records that it changed, or None when it
+changed those that matched some search criteria, whose ids were not read."""
+Edit = namedtuple('Edit', ['savepoint', 'table', 'ids'])
+
+################################################################################
+class EditJournal():
+    """
+    EditJournal makes record edits through a Database without committing each
+    one. The edits are held in a single open transaction on the Database's
+    writer connection, each within a savepoint of its own, so that the latest
+    edit may be undone by rolling back to its savepoint. The held edits are
+    committed together by flush(), at the cost of a single commit. Reads on
+    the same connection see the held edits, while other connections don't
+    until the flush, and other writers wait on it.
+    """
+    def __init__(self, db):
+        self.connections = db.connections
+        self.conn = db.conn
+        self.cache = db.cache
+        self.edits = []
+        self.savepoints = count(1)
+
+    def __len__(self):
+        return len(self.edits)
+
+    def add(self, db, record):
+        """Add a record to the Database's table. Return the new record's id."""
+        return self._edit(db, lambda: [db.add_record(record=record)])[0]
+
+    def update(self, db, ids, **kwargs):
+        """Update the same change(s) into each of the records with the passed
+        ids. Return the ids."""
+        return self._edit(db, lambda: db.update_records(ids, **kwargs) and ids)
+
+    def delete(self, db, ids):
+        """Delete each of the records with the passed ids. Return the ids."""
+        return self._edit(db, lambda: db.delete_records(ids) and ids)
+
+    def update_matching(self, db, criteria, **kwargs):
+        """Update the same change(s) into each of the records that match the
+        passed search criteria. Return None, as their ids are not read, or an
+        empty list if none matched."""
+        return self._edit(db, lambda: db.update_matching(criteria, **kwargs)
+                          and None)
+
+    def delete_matching(self, db, criteria):
+        """Delete each of the records that match the passed search criteria.
+        Return None, as their ids are not read, or an empty list if none
+        matched."""
+        return self._edit(db, lambda: db.delete_matching(criteria) and None)
+
+    def _edit(self, db, func):
+        """
+        Make an edit within a new savepoint, opening the held transaction if
+        need be. An edit that fails is rolled back, and its error raised.
+        Return the list of ids that func() returns, or None if it returns
+        None.
+        """
+        savepoint = 'edit_%d' % (next(self.savepoints))
+        if not self.edits:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.connections.hold = True
+        self.conn.execute('SAVEPOINT %s' % (savepoint))
+        try:
+            ids = func()
+            if ids is not None:
+                ids = list(ids or [])
+        except:
+            self._rollback(savepoint, db.table)
+            raise
+        self.edits.append(Edit(savepoint=savepoint, table=db.table, ids=ids))
+        return ids
+
+    def undo(self):
+        """Undo the latest held edit, and return it, or None if none is held."""
+        if not self.edits:
+            return None
+        edit = self.edits.pop()
+        self._rollback(edit.savepoint, edit.table)
+        return edit
+
+    def _rollback(self, savepoint, table):
+        """Roll back to a savepoint, which makes the results cached for the
+        named table stale, and end the held transaction if no edit is left in
+        it."""
+        self.conn.execute('ROLLBACK TO %s' % (savepoint))
+        self.cache.bump(table)
+        self.conn.execute('RELEASE %s' % (savepoint))
+        if not self.edits:
+            self.conn.rollback()
+            self.connections.hold = False
+
+    def flush(self):
+        """Commit every held edit. Return the count of edits committed."""
+        flushed = len(self.edits)
+        if flushed:
+            self.conn.commit()
+            self.edits = []
+            self.connections.hold = False
+        return flushed
@@ -0,0 +1,132 @@
+# pager.py v0.1                                                   -*- Python -*-
+
+# Provide paged, cached access to the records of an sqlite database-table.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+
+PAGE_SIZE = 100
+CACHE_PAGES = 8
+
+def prefetch(db, page_size=PAGE_SIZE, **kwargs):
+    """
+    Return the count of records that match the passed search criteria, and the
+    first page of them. These are the slow parts of building a Pager, and so
+    may be run ahead of time by a background worker.
+    """
+    return db.count_records(**kwargs), db.get_page(limit=page_size, **kwargs)
+
+################################################################################
+class Pager():
+    """
+    Pager gives indexed access to the records of a database table, or to just
+    those records that match some search criteria, while holding no more than
+    a few pages of them in memory. Each page is fetched by keyset pagination on
+    the 'id' column when the page before it is cached, and by offset when not.
+    Records that match a full-text query, passed as the 'match' criterion, are
+    in rank order instead, and so are always fetched by offset.
+    Pages are kept in a small least-recently-used cache. The record count and
+    first page may be passed in when already fetched, as by prefetch().
+    """
+    def __init__(self, db, count=None, first_page=None, page_size=PAGE_SIZE,
+                 cache_pages=CACHE_PAGES, **kwargs):
+        self.db = db
+        self.page_size = page_size
+        self.cache_pages = cache_pages
+        self.criteria = {key: kwargs[key] for key in kwargs if kwargs[key]}
+        self.pages = OrderedDict()
+        if count is None:
+            count = db.count_records(**self.criteria)
+        self.count = count
+        if first_page is not None:
+            self.pages[0] = first_page
+
+    def __len__(self):
+        return self.count
+
+    def get_records(self, first, count):
+        """
+        Return a list of up to 'count' records, beginning with the record at
+        position 'first'.
+        """
+        records = []
+        last = min(first + count, self.count)
+        while first < last:
+            number, start = divmod(first, self.page_size)
+            page = self.get_page(number)
+            if not page:
+                break
+            records.extend(page[start:start + last - first])
+            first = (number + 1) * self.page_size
+        return records
+
+    def get_page(self, number):
+        """Return the list of records on page 'number', from cache if able."""
+        if number in self.pages:
+            self.pages.move_to_end(number)
+            return self.pages[number]
+        previous = self.pages.get(number - 1)
+        after = previous[-1][0] if previous else None
+        page = self.db.get_page(after=after, offset=number * self.page_size,
+                                limit=self.page_size, **self.criteria)
+        self.pages[number] = page
+        if len(self.pages) > self.cache_pages:
+            self.pages.popitem(last=False)
+        return page
+
+    def refresh_record(self, id, record=None):
+        """
+        Bring the cache up to date after a change to the record with the passed
+        id, at the cost of a single-record query. The query is skipped when the
+        changed record is passed and there are no search criteria. Return the
+        record, or None if it is no longer in the sequence, and whether the
+        positions of records in the sequence have shifted. A record found in
+        the cache is replaced in place, or else dropped along with the pages
+        cached after it. A record not found in the cache is taken to be new to
+        the sequence. Records in rank order are not re-ranked in place, and any
+        shift among them drops every cached page.
+        """
+        ranked = bool(self.criteria.get('match'))
+        if record is None or self.criteria:
+            record = self.db.get_record(id, **self.criteria)
+        for number, page in self.pages.items():
+            for i, cached in enumerate(page):
+                if cached[0] != id:
+                    continue
+                if record:
+                    page[i] = record
+                    return record, False
+                self.count -= 1
+                self._drop_pages(lambda n, page: ranked or n >= number)
+                return None, True
+        if not record:
+            return None, False
+        self.count += 1
+        self._drop_pages(lambda n, page: ranked or not page or
+                         page[-1][0] >= id or len(page) < self.page_size)
+        return record, True
+
+    def reload(self):
+        """Drop every cached page, and count the records anew, after changes
+        that are too many to bring into the cache one at a time."""
+        self.pages.clear()
+        self.count = self.db.count_records(**self.criteria)
+
+    def _drop_pages(self, test):
+        """Drop each cached page for which test(number, page) is true."""
+        for number in [n for n, page in self.pages.items() if test(n, page)]:
+            del self.pages[number]
@@ -1,6 +1,6 @@
 # seed.py v0.1                                                    -*- Python -*-
 
-# Using a csv-formatted data file, generate a new database-table with seed data.
+# Using a delimited or JSON-lines file, generate a database-table of seed data.
 #   Project home: <https://github.com/zero2cx/the-python-mega-course>
 #   Copyright (C) 2017 David Schenck
 #
@@ -17,76 +17,275 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
 import os
 import csv
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
 from .db import Database
+from .source import SeedSource, clean_records, find_seed_file
+
+"""Seed data-types, ordered from narrowest to widest. A column's type only
+ever widens as more of its fields are inspected."""
+COLUMN_TYPES = ('INTEGER', 'REAL', 'TEXT')
+
+"""The fields that are inferred as INTEGER or REAL: plain decimal integers, and
+decimal reals with a point, an exponent or both. The other fields that int()
+and float() accept, such as 'nan', 'inf', 'Infinity' or '1_000', are TEXT, as
+Sqlite stores them as text."""
+INTEGER_FORMAT = re.compile(r'\s*[-+]?\d+\s*$', re.ASCII)
+REAL_FORMAT = re.compile(r'\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$',
+                         re.ASCII)
+
+"""The approximate size in bytes of each seed file chunk that is type-inferred
+by a worker process, when inferring in parallel."""
+CHUNK_BYTES = 8 * 1024 * 1024
 
-### TODO: extend flexibility for using a variety of seed data field-seperators.
-### TODO: maybe could write a data pre-processor to standardize sloppy seed data. DIFFICULT!!!
 ### TODO: add web-scraping as a source of seed data.
-def seed_database(path, name):
+def seed_database(path, name, sample=None, jobs=1, key=None, cleaners=()):
+    """
+    Read the contents of a file containing seed data for an Sqlite database-
+    table, as found by find_seed_file(). Then populate an Sqlite database and
+    save to file. If a file already exists, then do a destructive overwrite
+    with the new database file. The seed records are passed through the named
+    'cleaners' as they are read, ahead of type inference and loading.
+    The column data types are inferred from a full pass over the seed file, or
+    from just its first 'sample' records when a sample size is passed. When
+    'jobs' is more than 1, a plain, delimited seed file is parsed by that many
+    processes.
+    When a natural 'key' of column names is passed, then an existing database
+    is instead refreshed in place, by merging in only the seed records that
+    are new or have changed, and deleting those no longer seeded.
+    """
+    seed_file = find_seed_file(path, name)
+    if seed_file is None:
+        raise ValueError('seed file not found: %s' %
+                         (os.path.normpath('%s/%s.csv' % (path, name))))
+    source = SeedSource(file=seed_file, cleaners=cleaners)
+    db_file = os.path.normpath('%s/%s.db' % (path, name))
+    if key and os.path.isfile(path=db_file):
+        return _merge_database(path, name, source, key)
+    if jobs > 1 and source.can_split():
+        return _seed_database_parallel(path, name, source, sample, jobs, key)
+    """Fetch the column names from the seed file."""
+    records = iter(source)
+    column_names = next(records, None)
+    if not column_names:
+        return 1
+    """Parse the data records, and designate the appropriate data type for each
+    table column. A full pass reads the seed file twice rather than holding
+    its records in memory."""
+    if sample is None:
+        ranks = _get_column_ranks(records=records)
+        records = iter(source)
+        next(records)
+    else:
+        head = list(islice(records, sample))
+        ranks = _get_column_ranks(records=head)
+        records = _check_column_ranks(records=chain(head, records),
+                                      ranks=ranks, names=column_names)
+    columns = dict(zip(column_names, _get_rank_types(ranks=ranks)))
+    _create_database(path, name, columns, records, key)
+
+def _seed_database_parallel(path, name, source, sample, jobs, key=None):
     """
-    Read the contents of a csv-formatted file containing seed data for an Sqlite
-    database-table. Then populate an Sqlite database and save to file. If a file
-    already exists, then do a destructive overwrite with the new database file.
+    Seed the database as seed_database() does, but with the SeedSource's file
+    split into byte-range chunks that are parsed, cleaned and type-inferred in
+    a pool of 'jobs' worker processes. Only each chunk's column type ranks are
+    sent back, while the records themselves are streamed into the database by
+    this one writer process.
     """
-    """Fetch the seed data including column names from the seed file."""
-    column_names, records = _get_seed_data('%s/%s.csv' % (path, name))
+    records = iter(source)
+    column_names = next(records, None)
     if not column_names:
         return 1
-    """Parse each data record, and designate the appropriate data type for each
-    table column."""
-    columns = dict(zip(column_names, _get_column_types(records=records)))
+    bounds = _get_seed_chunks(source.file, jobs, quote=source.get_quote())
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_get_chunk_ranks, source.file, start, end,
+                                   source.dialect, source.cleaners)
+                   for start, end in bounds]
+        if sample is None:
+            """Wait on the full pass, then re-read the seed file to load it."""
+            ranks = _merge_column_ranks(*[f.result() for f in futures])
+            records = iter(source)
+            next(records)
+        else:
+            """Load while the workers continue type inference in the
+            background, then check the sampled types afterwards."""
+            head = list(islice(records, sample))
+            ranks = _get_column_ranks(records=head)
+            records = chain(head, records)
+        columns = dict(zip(column_names, _get_rank_types(ranks=ranks)))
+        _create_database(path, name, columns, records, key)
+        if sample is not None:
+            seen = _merge_column_ranks(ranks, *[f.result() for f in futures])
+            _report_column_ranks(names=column_names, ranks=ranks, seen=seen)
+
+def _create_database(path, name, columns, records, key=None):
+    """
+    Create a fresh database file holding one table with the passed columns, and
+    bulk-load the passed records into it. With a natural 'key', the records are
+    merged in, so that their seed hashes are kept for the next refresh.
+    """
     """Delete the old database file, if exists."""
     db_file = os.path.normpath('%s/%s.db' % (path, name))
     if os.path.isfile(path=db_file):
         os.remove(db_file)
-    """Create and connect to an empty database file. Add seed data to it, then
-    close the connection."""
-    db = Database(path=path, name=name, **columns)
+    """Create and connect to an empty database file. Add seed data to it, and
+    build the full-text index over it in bulk, then close the connection."""
+    with Database(path=path, name=name, **columns) as db:
+        if key:
+            db.merge_records(records=records, names=list(columns), key=key)
+        else:
+            db.add_records(records=records)
+        db.create_text_index()
+
+def _merge_database(path, name, source, key):
+    """
+    Refresh an existing database-table from its SeedSource, by the natural
+    'key' columns. The table keeps its column types, indexes, and any edits
+    made to records whose seed data has not changed.
+    """
+    records = iter(source)
+    column_names = next(records, None)
+    if not column_names:
+        return 1
+    with Database(path=path, name=name) as db:
+        db.merge_records(records=records, names=column_names, key=key)
+
+def _get_field_rank(field):
+    """Return the position within COLUMN_TYPES of a single field's data type."""
+    if INTEGER_FORMAT.match(field):
+        return 0
+    if REAL_FORMAT.match(field):
+        return 1
+    return 2
+
+def _get_column_ranks(records, ranks=None):
+    """
+    Widen the per-column type ranks to cover each of the passed records, and
+    return them. Empty fields say nothing about a column's type, and a column
+    with no non-empty fields at all has a rank of -1.
+    """
+    ranks = ranks if ranks is not None else []
     for record in records:
-        db.add_record(record=record)
-    db.close()
+        if len(record) > len(ranks):
+            ranks.extend([-1] * (len(record) - len(ranks)))
+        for i, field in enumerate(record):
+            if ranks[i] == 2 or not field:
+                continue
+            rank = _get_field_rank(field)
+            if rank > ranks[i]:
+                ranks[i] = rank
+    return ranks
+
+def _merge_column_ranks(*rank_lists):
+    """Combine per-column type ranks into ranks that cover all of them."""
+    merged = []
+    for ranks in rank_lists:
+        for i, rank in enumerate(ranks):
+            if i == len(merged):
+                merged.append(rank)
+            elif rank > merged[i]:
+                merged[i] = rank
+    return merged
 
-def _get_seed_data(seed_file):
+def _get_rank_types(ranks):
+    """Translate per-column type ranks into table column data types."""
+    return [COLUMN_TYPES[rank] if rank >= 0 else 'TEXT' for rank in ranks]
+
+def _check_column_ranks(records, ranks, names):
     """
-    Read a csv-formatted file and return the contents as two lists. A list of
-    database-table column names, and a list of data records of type list.
+    Pass through each record unchanged, while continuing type inference beyond
+    the sampled records. Once every record has passed, report any column whose
+    fields turned out wider than its sampled data type.
     """
-    rows = []
-    with open(file=seed_file, newline='') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            rows.append(row)
-    return rows.pop(0), rows
+    seen = list(ranks)
+    for record in records:
+        _get_column_ranks(records=(record,), ranks=seen)
+        yield record
+    _report_column_ranks(names=names, ranks=ranks, seen=seen)
+
+def _report_column_ranks(names, ranks, seen):
+    """Warn of each column whose seen data type is wider than its table column
+    data type."""
+    for i, name in enumerate(names[:len(ranks)]):
+        if 0 <= ranks[i] < seen[i]:
+            print('**Warning: column %s holds %s data, sampled as %s' %
+                  (name, COLUMN_TYPES[seen[i]], COLUMN_TYPES[ranks[i]]))
 
 def _get_column_types(records):
-    """Build a list of lists that makes note of the data type of each field
-    within each data record."""
-    data_types = []
-    for i in range(len(records[0])):
-        data_types.append([])
-    for record in records:
-        for i in range(len(data_types)):
-            try:
-                int(record[i])
-            except ValueError:
-                try:
-                    float(record[i])
-                except:
-                    data_types[i].append('TEXT')
-                else:
-                    data_types[i].append('REAL')
-            else:
-                data_types[i].append('INTEGER')
-    """Assign types to the table columns to match the parsed data types from the
-    above list-of-lists."""
-    column_types = []
-    for i in range(len(data_types)):
-        if 'REAL' in data_types[i]:
-            column_types.append('REAL')
-        elif 'INTEGER' in data_types[i]:
-            column_types.append('INTEGER')
-        else:
-            column_types.append('TEXT')
-    return column_types
+    """Return the data type for each table column that suits every field of the
+    passed data records."""
+    return _get_rank_types(ranks=_get_column_ranks(records=records))
+
+def _get_seed_chunks(seed_file, jobs, quote=b'"'):
+    """
+    Split the data records of a seed file, those after its header record, into
+    byte ranges that each hold whole records. Return a list of the (start,
+    end) offsets of the ranges.
+    """
+    size = os.path.getsize(seed_file)
+    with open(file=seed_file, mode='rb') as file:
+        header_end = _find_record_end(file, 0, 0, quote=quote)
+        count = max(jobs, (size - header_end) // CHUNK_BYTES)
+        step = (size - header_end) / count
+        bounds = []
+        start = header_end
+        for i in range(1, count + 1):
+            end = size if i == count else \
+                    _find_record_end(file, start, int(header_end + step * i),
+                                     quote=quote)
+            if end > start:
+                bounds.append((start, end))
+                start = end
+    return bounds
+
+def _find_record_end(file, start, pos, quote=b'"', block_size=65536):
+    """
+    Return the byte offset just past the first record-ending newline at or
+    after 'pos', given that a record begins at 'start'. A newline only ends a
+    record when an even count of 'quote' characters precedes it, so that quoted
+    fields containing newlines are never split. Return the end-of-file offset
+    if no such newline follows.
+    """
+    pos = max(pos, start)
+    file.seek(start)
+    quotes = 0
+    remaining = pos - start
+    while remaining > 0:
+        block = file.read(min(block_size, remaining))
+        if not block:
+            return file.tell()
+        quotes += block.count(quote)
+        remaining -= len(block)
+    while True:
+        block = file.read(block_size)
+        if not block:
+            return pos
+        i = 0
+        while True:
+            newline = block.find(b'\n', i)
+            if newline < 0:
+                quotes += block.count(quote, i)
+                break
+            quotes += block.count(quote, i, newline)
+            if quotes % 2 == 0:
+                return pos + newline + 1
+            i = newline + 1
+        pos += len(block)
+
+def _get_chunk_ranks(seed_file, start, end, dialect=None, cleaners=()):
+    """
+    Parse the delimited records within a byte range of a seed file, in the
+    passed dialect, clean them with the named cleaners, and return the type
+    ranks of their columns. The range is decoded as UTF-8, as the whole file
+    is, whatever the locale's preferred encoding.
+    """
+    with open(file=seed_file, mode='rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', newline='')
+    records = csv.reader(text, **(dialect or {}))
+    return _get_column_ranks(records=clean_records(records, cleaners))
@@ -0,0 +1,483 @@
+# server.py v0.1                                                  -*- Python -*-
+
+# Serve the tables of an sqlite database to many clients at once, as HTTP/JSON.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import queue
+import signal
+import sqlite3
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import parse_qsl, unquote, urlsplit
+from .db import READ_POOL_SIZE, Database
+from .export import EXPORT_BATCH_SIZE
+from .journal import EditJournal
+from .pager import PAGE_SIZE
+
+HOST = '127.0.0.1'
+PORT = 8080
+
+"""A page of records holds PAGE_SIZE records unless a 'limit' is asked for, of
+at most MAX_PAGE_SIZE. A request body may be at most MAX_BODY_BYTES long."""
+MAX_PAGE_SIZE = 1000
+MAX_BODY_BYTES = 1024 * 1024
+
+"""The writer commits the writes that queue up while it is busy together, up
+to this many at a time."""
+GROUP_COMMIT_SIZE = 256
+
+STATUS_TEXT = {
+    200: 'OK',
+    201: 'Created',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+def serve(path, name, host=HOST, port=PORT):
+    """
+    Serve the named database's tables on the passed host and port, until
+    interrupted or terminated. Writes still queued then are committed before
+    the database is closed.
+    """
+    server = DatabaseServer(path=path, name=name)
+    try:
+        asyncio.run(server.run(host=host, port=port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        server.close()
+
+################################################################################
+class HTTPError(Exception):
+    """HTTPError ends a request with an HTTP error status, and a message."""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+################################################################################
+class GroupWriter():
+    """
+    GroupWriter makes every write to the database on a single writer thread,
+    which has its own connection. Writes are submitted as jobs, and each job's
+    Future holds its result once it is committed. The jobs that queue up while
+    a commit is under way are run together, each within an EditJournal
+    savepoint of its own, so that a job that fails is rolled back alone, and
+    the rest are committed at the cost of a single commit.
+    """
+    def __init__(self, path, name):
+        self.jobs = queue.Queue()
+        self.db = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(path, name),
+                                       daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def submit(self, func, *args):
+        """
+        Queue the call func(journal, db, *args) to run on the writer thread,
+        where 'journal' is the writer's EditJournal and 'db' its Database.
+        Return a Future of the call's result.
+        """
+        future = Future()
+        self.jobs.put((func, args, future))
+        return future
+
+    def close(self):
+        """Stop the writer thread, once its queued jobs are committed."""
+        self.jobs.put(None)
+        self.thread.join()
+
+    def _run(self, path, name):
+        """Run queued jobs in groups, committing each group once."""
+        self.db = Database(path=path, name=name)
+        journal = EditJournal(self.db)
+        self.ready.set()
+        stopping = False
+        while not stopping:
+            batch = [self.jobs.get()]
+            while batch[-1] is not None and len(batch) < GROUP_COMMIT_SIZE:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+                batch.pop()
+            results = []
+            for func, args, future in batch:
+                try:
+                    results.append((future, func(journal, self.db, *args),
+                                    None))
+                except Exception as e:
+                    results.append((future, None, e))
+            try:
+                journal.flush()
+            except sqlite3.Error as e:
+                while journal.undo():
+                    pass
+                results = [(future, None, e) for future, _, _ in results]
+            for future, result, error in results:
+                if future.cancelled():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        """Let the connection be closed and released on its own thread."""
+        self.db.close()
+        self.db = None
+
+################################################################################
+class DatabaseServer():
+    """
+    DatabaseServer answers HTTP/1.1 requests for the records of a database's
+    tables with JSON, on an asyncio event loop. Reads are run on a pool of
+    threads, each through a read-only connection lent by the database's
+    ConnectionManager, so that they run alongside each other and alongside
+    the writes. Writes go through a single GroupWriter. Exports are streamed
+    as chunked responses, one batch of records at a time.
+
+        GET    /                  the names of the database's tables
+        GET    /TABLE             a page of the records that match the query's
+                                  COLUMN=VALUE criteria, and a full-text
+                                  'match', if passed, with the query to pass
+                                  for the next page, if any
+        GET    /TABLE/count       the count of the records that match
+        GET    /TABLE/export      every record that matches, as JSON lines
+        GET    /TABLE/ID          the record with id ID
+        POST   /TABLE             add a record, of the body's fields
+        PATCH  /TABLE/ID          change the body's fields of record ID
+        DELETE /TABLE/ID          delete record ID
+    """
+    def __init__(self, path, name, readers=READ_POOL_SIZE):
+        self.writer = GroupWriter(path=path, name=name)
+        self.executor = ThreadPoolExecutor(max_workers=readers)
+        self.readers = {}
+        self.server = None
+
+    async def run(self, host=HOST, port=PORT):
+        """Serve requests until cancelled, as by a SIGTERM where the platform
+        lets the event loop handle it."""
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                    signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+        self.server = await asyncio.start_server(self._serve_client, host,
+                                                 port)
+        for socket in self.server.sockets:
+            print('Serving %s on http://%s:%d/' %
+                  ((self.writer.db.file,) + socket.getsockname()[:2]),
+                  flush=True)
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        """Stop taking reads, and commit the queued writes."""
+        self.executor.shutdown()
+        self.writer.close()
+
+    async def read(self, func, *args):
+        """
+        Await the call func(db, *args) on a reader thread, where 'db' is a
+        handle on the database that reads through a lent connection.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._read, func,
+                                          args)
+
+    def _read(self, func, args):
+        """Make a read call with a lent connection, on a reader thread. Each
+        connection's reader handle is kept, along with its result cache."""
+        with self.writer.db.reader() as conn:
+            if conn not in self.readers:
+                self.readers[conn] = self.writer.db.get_reader(conn)
+            return func(self.readers[conn], *args)
+
+    async def write(self, func, *args):
+        """Await the call func(journal, db, *args) on the writer thread."""
+        return await asyncio.wrap_future(self.writer.submit(func, *args))
+
+    async def _serve_client(self, reader, writer):
+        """Answer each request on a client connection, until it is closed."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        ConnectionError):
+                    break
+                try:
+                    method, target, keep_alive, length = _parse_head(head)
+                    if length > MAX_BODY_BYTES:
+                        keep_alive = False
+                        raise HTTPError(413, 'request body too large')
+                    body = await reader.readexactly(length)
+                    await self._respond(writer, method, target, body,
+                                        keep_alive)
+                except HTTPError as e:
+                    _write_json(writer, e.status, {'error': str(e)},
+                                keep_alive=False)
+                    keep_alive = False
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, method, target, body, keep_alive):
+        """Route a request, and write its response. An error that the request
+        itself caused is answered with status 400, and any other error with
+        status 500."""
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        query = dict(parse_qsl(url.query))
+        try:
+            """The reads pass 'cache' to get_page() themselves."""
+            if 'cache' in query:
+                raise HTTPError(400, 'invalid query field: cache')
+            if len(parts) == 2 and parts[1] == 'export':
+                if method != 'GET':
+                    raise HTTPError(405, 'method not allowed')
+                await self._export(writer, parts[0], query, keep_alive)
+                return
+            status, value = await self._route(method, parts, query, body)
+        except HTTPError as e:
+            status, value = e.status, {'error': str(e)}
+        except ConnectionError:
+            raise
+        except (sqlite3.Error, ValueError) as e:
+            status, value = 400, {'error': str(e)}
+        except Exception as e:
+            print('**Error: %s %s: %r' % (method, target, e), file=sys.stderr)
+            status, value = 500, {'error': 'internal server error'}
+        _write_json(writer, status, value, keep_alive)
+
+    async def _route(self, method, parts, query, body):
+        """Run the request's read or write, and return the status and value
+        of its response."""
+        if not parts:
+            if method != 'GET':
+                raise HTTPError(405, 'method not allowed')
+            return 200, await self.read(_get_tables)
+        table = parts[0]
+        if len(parts) == 1:
+            if method == 'GET':
+                paging = [query.pop(key, None)
+                          for key in ('after', 'offset', 'limit')]
+                return 200, await self.read(_get_page, table, query, *paging)
+            if method == 'POST':
+                return 201, await self.write(_insert, table, _get_body(body))
+        elif len(parts) == 2 and parts[1] == 'count':
+            if method == 'GET':
+                return 200, await self.read(_count, table, query)
+        elif len(parts) == 2:
+            id = _get_int(parts[1], 'id')
+            if method == 'GET':
+                return 200, await self.read(_get_record, table, id)
+            if method in ('PATCH', 'PUT'):
+                return 200, await self.write(_update, table, id,
+                                             _get_body(body))
+            if method == 'DELETE':
+                return 200, await self.write(_delete, table, id)
+        else:
+            raise HTTPError(404, 'no such resource')
+        raise HTTPError(405, 'method not allowed')
+
+    async def _export(self, writer, table, query, keep_alive):
+        """
+        Stream every record that matches the query, as one line of JSON each,
+        in a chunked response. Each batch is read through whichever connection
+        is free, so that no read is held open for the whole export. A client
+        that stops reading slows the export down, rather than letting batches
+        pile up in memory. An error before the first batch is answered as any
+        other, while an error after it cuts the response short.
+        """
+        names, batch = await self.read(_get_batch, table, query, None, 0)
+        writer.write(_get_head(200, 'application/x-ndjson',
+                               keep_alive=keep_alive, chunked=True))
+        offset = 0
+        try:
+            while batch:
+                data = ''.join('%s\n' % (json.dumps(dict(zip(names, record)),
+                                                    default=str))
+                               for record in batch).encode()
+                writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+                await writer.drain()
+                if len(batch) < EXPORT_BATCH_SIZE:
+                    break
+                offset += len(batch)
+                after = None if query.get('match') else batch[-1][0]
+                names, batch = await self.read(_get_batch, table, query,
+                                               after, offset)
+        except (sqlite3.Error, ValueError, HTTPError) as e:
+            print('**Error: export of %s: %s' % (table, e), file=sys.stderr)
+            raise ConnectionAbortedError(str(e))
+        writer.write(b'0\r\n\r\n')
+
+def _parse_head(head):
+    """
+    Return the method and target of a request, whether its connection is to
+    be kept alive, and the length of its body, from the request's head.
+    """
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HTTPError(400, 'malformed request line')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    if 'chunked' in headers.get('transfer-encoding', ''):
+        raise HTTPError(400, 'chunked request bodies are not supported')
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else \
+            connection == 'keep-alive'
+    length = _get_int(headers.get('content-length', '0'), 'content-length')
+    return method, target, keep_alive, length
+
+def _get_head(status, content_type, length=None, keep_alive=True,
+              chunked=False):
+    """Return the head of a response, as bytes."""
+    lines = ['HTTP/1.1 %d %s' % (status, STATUS_TEXT[status]),
+             'Content-Type: %s' % (content_type)]
+    if chunked:
+        lines.append('Transfer-Encoding: chunked')
+    else:
+        lines.append('Content-Length: %d' % (length))
+    if not keep_alive:
+        lines.append('Connection: close')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+def _write_json(writer, status, value, keep_alive=True):
+    """Write a response whose body is a value, as JSON."""
+    data = json.dumps(value, default=str).encode()
+    writer.write(_get_head(status, 'application/json', len(data), keep_alive))
+    writer.write(data)
+
+def _get_body(body):
+    """Return a request body that holds a JSON object of record fields."""
+    try:
+        fields = json.loads(body or b'{}')
+    except ValueError:
+        raise HTTPError(400, 'request body is not JSON')
+    if not isinstance(fields, dict):
+        raise HTTPError(400, 'request body is not a JSON object')
+    return fields
+
+def _get_int(value, name):
+    """Return a request's value as an integer, or end the request with 400."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, 'invalid %s: %r' % (name, value))
+
+def _get_table(db, table):
+    """Return the handle on a table, or end the request with 404."""
+    try:
+        return db.get_table(table)
+    except ValueError as e:
+        raise HTTPError(404, str(e))
+
+def _get_object(db, record):
+    """Return a record as a dictionary keyed by column name."""
+    return dict(zip(db.get_column_names(pkey=True), record))
+
+"""The reads, each run as func(db, *args) on a reader thread."""
+def _get_tables(db):
+    """Return the names of the database's tables."""
+    return {'tables': db.get_tables()}
+
+def _get_page(db, table, criteria, after, offset, limit):
+    """
+    Return a page of the table's records that match the criteria, and the
+    paging arguments to pass for the next page, if there may be one. Pages in
+    'id' order follow on by id, while pages in rank order follow on by offset.
+    """
+    db = _get_table(db, table)
+    limit = _get_int(limit or PAGE_SIZE, 'limit')
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise HTTPError(400, 'invalid limit: %d' % (limit))
+    after = None if after is None else _get_int(after, 'after')
+    offset = _get_int(offset or 0, 'offset')
+    records = db.get_page(after=after, offset=offset, limit=limit, **criteria)
+    following = None
+    if len(records) == limit:
+        following = {'offset': offset + limit} if criteria.get('match') else \
+                {'after': records[-1][0]}
+    return {'records': [_get_object(db, record) for record in records],
+            'next': following}
+
+def _count(db, table, criteria):
+    """Return the count of the table's records that match the criteria."""
+    return {'count': _get_table(db, table).count_records(**criteria)}
+
+def _get_record(db, table, id):
+    """Return the table's record with the passed id."""
+    db = _get_table(db, table)
+    record = db.get_record(id)
+    if record is None:
+        raise HTTPError(404, 'no such record: %d' % (id))
+    return _get_object(db, record)
+
+def _get_batch(db, table, criteria, after, offset):
+    """Return the table's column names, and the next batch of an export,
+    which is read past the reader's ResultCache."""
+    db = _get_table(db, table)
+    return db.get_column_names(pkey=True), db.get_page(
+            after=after, offset=offset, limit=EXPORT_BATCH_SIZE, cache=False,
+            **criteria)
+
+"""The writes, each run as func(journal, db, *args) on the writer thread."""
+def _insert(journal, db, table, fields):
+    """Add a record of the passed fields, one for each column, and return
+    it."""
+    db = _get_table(db, table)
+    names = db.get_column_names()
+    if sorted(fields) != sorted(names):
+        raise ValueError('insert takes exactly one of each field: %s' %
+                         (', '.join(names)))
+    id = journal.add(db, [fields[name] for name in names])
+    return _get_object(db, db.get_record(id))
+
+def _update(journal, db, table, id, fields):
+    """Change the passed fields of the record with the passed id, and return
+    the record."""
+    db = _get_table(db, table)
+    if not fields:
+        raise ValueError('update takes at least one field')
+    if not journal.update(db, [id], **fields):
+        raise HTTPError(404, 'no such record: %d' % (id))
+    return _get_object(db, db.get_record(id))
+
+def _delete(journal, db, table, id):
+    """Delete the record with the passed id."""
+    db = _get_table(db, table)
+    if not journal.delete(db, [id]):
+        raise HTTPError(404, 'no such record: %d' % (id))
+    return {'deleted': id}
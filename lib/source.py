@@ -0,0 +1,282 @@
+# source.py v0.1                                                  -*- Python -*-
+
+# Read seed data records from delimited or JSON-lines files, and clean them up.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import bz2
+import codecs
+import csv
+import gzip
+import json
+import lzma
+import mmap
+import os
+import re
+from contextlib import closing
+from datetime import datetime
+from functools import lru_cache
+
+"""Seed file name extensions, in the order that they are looked for, each of
+which may be followed by a compression extension. Files of the JSON-lines
+extensions hold one JSON object per line, while the others hold delimited
+text."""
+SEED_EXTENSIONS = ('.csv', '.tsv', '.psv', '.txt', '.jsonl', '.ndjson')
+JSON_EXTENSIONS = ('.jsonl', '.ndjson')
+COMPRESSIONS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+"""The dialect of a delimited seed file is sniffed from about this many of its
+first characters, with its field separator taken to be one of DELIMITERS. When
+sniffing fails, the separator is chosen by the file name extension."""
+SNIFF_CHARS = 64 * 1024
+DELIMITERS = ',\t|;'
+EXTENSION_DELIMITERS = {'.tsv': '\t', '.psv': '|'}
+
+"""Fields that the 'nulls' cleaner makes NULL, compared without regard to case,
+along with blank fields."""
+NULL_TOKENS = frozenset(('null', 'none', 'nil', 'n/a', 'na', 'nan', '-'))
+
+"""Field formats that the 'numbers' and 'dates' cleaners recognize. A number
+may have a sign, a currency symbol and comma thousands separators, which are
+all dropped but the sign. Dates are tried in order against each format, and
+written as YYYY-MM-DD. Dates with slashes are taken to be month first."""
+NUMBER_FORMAT = re.compile(r'\s*([-+]?)[$€£]?'
+                           r'(\d{1,3}(?:,\d{3})+|\d+)(\.\d+)?\s*$')
+DATE_FORMATS = ('%Y-%m-%d', '%d %B %Y', '%d %b %Y', '%B %d, %Y', '%b %d, %Y',
+                '%d-%b-%Y', '%m/%d/%Y', '%Y/%m/%d', '%d.%m.%Y')
+DATE_LIKE = re.compile(r'\s*(?:\d{1,4}[-/. ][A-Za-z]{3,9}[-/. ]\d{4}|'
+                       r'\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}|'
+                       r'[A-Za-z]{3,9} \d{1,2}, \d{4})\s*$')
+
+def find_seed_file(path, name):
+    """
+    Return the path of the seed file for the named database in the directory
+    'path', trying each of SEED_EXTENSIONS in turn, plain and then compressed.
+    Return None if there is no such file.
+    """
+    for extension in SEED_EXTENSIONS:
+        for compression in ('',) + tuple(COMPRESSIONS):
+            seed_file = os.path.normpath('%s/%s%s%s' %
+                                         (path, name, extension, compression))
+            if os.path.isfile(seed_file):
+                return seed_file
+    return None
+
+def get_cleaners(names):
+    """
+    Return the list of cleaners named in a comma-seperated string, in order,
+    or all of them for 'all'. Raise ValueError on an unknown name.
+    """
+    if names == 'all':
+        return list(CLEANERS)
+    cleaners = [name for name in names.split(',') if name]
+    for name in cleaners:
+        if name not in CLEANERS:
+            raise ValueError('unknown cleaner: %r' % (name))
+    return cleaners
+
+def clean_records(records, cleaners):
+    """
+    Return an iterator over the passed records, as cleaned by each named
+    cleaner in turn. The cleaners are generators, chained one onto the next,
+    so that each record is cleaned only as it is read.
+    """
+    for name in cleaners:
+        records = CLEANERS[name](records)
+    return records
+
+def trim_fields(records):
+    """Yield each record with the whitespace stripped from its fields."""
+    for record in records:
+        yield [field if field is None else field.strip() for field in record]
+
+def null_fields(records):
+    """Yield each record with its blank and NULL_TOKENS fields made None, so
+    that they neither widen a column's type nor get stored as text, but are
+    stored as NULL. The other cleaners pass None fields through."""
+    for record in records:
+        yield [None if field is None or not field.strip() or
+               field.strip().lower() in NULL_TOKENS else field
+               for field in record]
+
+def number_fields(records):
+    """Yield each record with its formatted numbers, such as '$1,234.50',
+    written plainly, such as '1234.50'."""
+    for record in records:
+        yield [_get_number(field) for field in record]
+
+def _get_number(field):
+    """Return a field in NUMBER_FORMAT as a plain number, or else unchanged."""
+    match = field and NUMBER_FORMAT.match(field)
+    if not match:
+        return field
+    sign, digits, fraction = match.groups()
+    return '%s%s%s' % (sign, digits.replace(',', ''), fraction or '')
+
+def date_fields(records):
+    """Yield each record with its dates, such as '12 January 1969', written as
+    YYYY-MM-DD, such as '1969-01-12'."""
+    for record in records:
+        yield [_get_date(field) if field and DATE_LIKE.match(field) else field
+               for field in record]
+
+@lru_cache(maxsize=4096)
+def _get_date(field):
+    """Return a date-like field in the first of DATE_FORMATS that it fits as
+    YYYY-MM-DD, or else unchanged. Seed data repeats its dates often, and so
+    the results are cached."""
+    for format in DATE_FORMATS:
+        try:
+            return datetime.strptime(field.strip(), format).date().isoformat()
+        except ValueError:
+            continue
+    return field
+
+"""The cleaners, by name, in the order that 'all' of them are run."""
+CLEANERS = {
+    'trim': trim_fields,
+    'nulls': null_fields,
+    'numbers': number_fields,
+    'dates': date_fields,
+}
+
+################################################################################
+class SeedSource():
+    """
+    SeedSource reads a seed file one record at a time, each as a list of
+    fields, the first of which holds the column names. The file holds either
+    delimited text, whose dialect is sniffed from its first lines, or JSON
+    lines, whose first object's keys are the column names. It may also be
+    compressed with gzip, bz2 or xz, which is undone as it is read, while a
+    plain file is read through a memory map. The data records are passed
+    through the named cleaners on their way out. A SeedSource may be iterated
+    more than once, and each pass reads the file anew.
+    """
+    def __init__(self, file, cleaners=()):
+        self.file = file
+        self.cleaners = tuple(cleaners)
+        for name in self.cleaners:
+            if name not in CLEANERS:
+                raise ValueError('unknown cleaner: %r' % (name))
+        base, extension = os.path.splitext(file)
+        self.compression = extension if extension in COMPRESSIONS else None
+        if self.compression:
+            extension = os.path.splitext(base)[1]
+        sample = self._get_sample()
+        self.json = extension in JSON_EXTENSIONS or \
+                sample.lstrip().startswith('{')
+        self.dialect = None if self.json else \
+                self._get_dialect(sample, extension)
+
+    def __iter__(self):
+        records = self._read_json() if self.json else \
+                csv.reader(self._read_lines(), **self.dialect)
+        header = next(records, None)
+        if header is None:
+            return
+        yield header
+        yield from clean_records(records, self.cleaners)
+
+    def can_split(self):
+        """Return whether the file may be split into byte ranges of whole
+        records, which only a plain, delimited file may be."""
+        return not self.compression and not self.json
+
+    def get_quote(self):
+        """Return the delimited file's quote character, as a byte string."""
+        return (self.dialect or {}).get('quotechar', '"').encode()
+
+    def _get_sample(self):
+        """Return the file's first whole lines, of about SNIFF_CHARS in all."""
+        lines = []
+        size = 0
+        with closing(self._read_lines()) as file:
+            for line in file:
+                lines.append(line)
+                size += len(line)
+                if size >= SNIFF_CHARS:
+                    break
+        return ''.join(lines)
+
+    def _get_dialect(self, sample, extension):
+        """
+        Return the delimited file's dialect, sniffed from a sample of it, as a
+        dictionary of csv format parameters. When the sample doesn't settle
+        it, then the field separator is chosen by the file name extension.
+        Only the field separator and quote character are taken from the
+        sniffer, which often misjudges the rest. Quotes within quoted fields
+        are taken to be doubled, as in RFC 4180, unless the sniffer found an
+        escape character.
+        """
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=DELIMITERS)
+        except csv.Error:
+            return {'delimiter': EXTENSION_DELIMITERS.get(extension, ',')}
+        if dialect.escapechar:
+            return {'delimiter': dialect.delimiter,
+                    'quotechar': dialect.quotechar or '"',
+                    'doublequote': False,
+                    'escapechar': dialect.escapechar}
+        return {'delimiter': dialect.delimiter,
+                'quotechar': dialect.quotechar or '"'}
+
+    def _read_lines(self):
+        """
+        Yield the file's text one line at a time, with its line endings kept,
+        as csv.reader() expects. A byte order mark is skipped.
+        """
+        if self.compression:
+            with COMPRESSIONS[self.compression](self.file, mode='rt',
+                                                encoding='utf-8-sig',
+                                                newline='') as file:
+                yield from file
+            return
+        with open(file=self.file, mode='rb') as file:
+            if not os.fstat(file.fileno()).st_size:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+                    data.seek(len(codecs.BOM_UTF8))
+                for line in iter(data.readline, b''):
+                    yield line.decode('utf-8')
+
+    def _read_json(self):
+        """
+        Yield the column names, taken from the keys of the file's first JSON
+        object, and then each object's values for those columns, as text. A
+        missing or null value is an empty field, and a nested value is written
+        as JSON. Raise ValueError on a line that is not a JSON object.
+        """
+        names = None
+        for number, line in enumerate(self._read_lines(), 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('seed record is not a JSON object: %s, '
+                                 'line %d' % (self.file, number))
+            if names is None:
+                names = list(record)
+                yield names
+            yield [_get_json_field(record.get(name)) for name in names]
+
+def _get_json_field(value):
+    """Return a JSON value as a seed data field."""
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
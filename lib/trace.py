@@ -0,0 +1,249 @@
+# trace.py v0.1                                                   -*- Python -*-
+
+# Time and tally the statements that are run on sqlite database connections.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import atexit
+import os
+import re
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+"""Tracing is enabled at startup when this environment variable is set to
+anything but '' or '0'. A number above 1 is taken as the slow-query threshold,
+in milliseconds."""
+TRACE_ENV = 'DB_APP_TRACE'
+
+"""A statement is logged as slow when it runs for at least this long. The
+slowest statements are kept, up to SLOW_QUERY_COUNT, with their query plans.
+A summary is written this often while tracing, and once more at exit."""
+SLOW_QUERY_SECONDS = 0.1
+SLOW_QUERY_COUNT = 20
+SUMMARY_SECONDS = 60.0
+
+"""A traced connection's progress handler runs once per this many virtual
+machine steps, and its calls count toward the timed statement's steps."""
+PROGRESS_STEPS = 1000
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w.])-?\d+(?:\.\d+)?"
+                       r"(?:[eE][-+]?\d+)?(?![\w.])")
+_SPACES = re.compile(r'\s+')
+
+_tracer = None
+_managers = weakref.WeakSet()
+
+def get_shape(sql):
+    """Return a statement's text with its literal values replaced by '?', so
+    that every run of one parameterized statement has the same shape."""
+    return _SPACES.sub(' ', _LITERALS.sub('?', sql)).strip()
+
+def get_tracer():
+    """Return the active Tracer, or None when tracing is disabled."""
+    return _tracer
+
+def watch(manager):
+    """
+    Have a connection manager traced whenever tracing is enabled. The manager
+    must provide set_tracer(tracer), which attaches the passed Tracer to each
+    of its connections, or detaches them when passed None.
+    """
+    _managers.add(manager)
+
+def enable_tracing(slow_seconds=SLOW_QUERY_SECONDS,
+                   summary_seconds=SUMMARY_SECONDS, file=None):
+    """
+    Start tracing every watched connection, and every connection opened from
+    now on, and return the Tracer. Its summary is written to 'file', which
+    defaults to standard error, every 'summary_seconds' and at exit.
+    """
+    global _tracer
+    disable_tracing()
+    _tracer = Tracer(slow_seconds=slow_seconds,
+                     summary_seconds=summary_seconds, file=file)
+    for manager in list(_managers):
+        manager.set_tracer(_tracer)
+    return _tracer
+
+def disable_tracing():
+    """Stop tracing, after writing a last summary of what was traced."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return
+    for manager in list(_managers):
+        manager.set_tracer(None)
+    tracer.stop()
+
+################################################################################
+class Tracer():
+    """
+    Tracer times the statements run on the connections attached to it. The
+    callers time each statement by the wall clock, within a timing() block,
+    while each connection's trace callback names the statement, and its
+    progress handler counts the statement's virtual machine steps. Statements
+    are tallied by shape, with their count, total and longest time, and steps.
+    Slow statements are logged as they finish, and kept along with their query
+    plans, which are looked up later, off the traced thread.
+    """
+    def __init__(self, slow_seconds=SLOW_QUERY_SECONDS,
+                 summary_seconds=SUMMARY_SECONDS, file=None):
+        self.slow_seconds = slow_seconds
+        self.summary_seconds = summary_seconds
+        self.file = file
+        self.shapes = {}
+        self.states = {}
+        self.slow = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.started = time.perf_counter()
+        if summary_seconds:
+            threading.Thread(target=self._summarize, daemon=True).start()
+        atexit.register(self.stop)
+
+    def attach(self, conn, explain=None):
+        """
+        Trace the statements run on a connection. The passed explain(sql)
+        callable returns a statement's query plan, without running it on the
+        traced connection.
+        """
+        state = {'sql': None, 'steps': 0}
+        def trace(sql):
+            """Statements that a trigger or a full-text index runs are traced
+            with a leading comment, and belong to the statement that ran
+            them."""
+            if not sql.startswith('--') and not sql.startswith('EXPLAIN'):
+                state['sql'] = sql
+        def progress():
+            state['steps'] += PROGRESS_STEPS
+            return 0
+        self.states[id(conn)] = (state, explain)
+        conn.set_trace_callback(trace)
+        conn.set_progress_handler(progress, PROGRESS_STEPS)
+
+    def detach(self, conn):
+        """Stop tracing a connection."""
+        conn.set_trace_callback(None)
+        conn.set_progress_handler(None, 0)
+        self.states.pop(id(conn), None)
+
+    @contextmanager
+    def timing(self, conn):
+        """
+        Time the statement run on a traced connection within a 'with' block,
+        by the wall clock, and tally it once the block ends. The time spent
+        waiting on locks, syncing to disk, and in user functions is all
+        counted. Where several statements run within the block, as an implicit
+        BEGIN ahead of an edit, the block is tallied as the last of them.
+        """
+        state, explain = self.states.get(id(conn), (None, None))
+        if state is None:
+            yield
+            return
+        state.update(sql=None, steps=0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if state['sql'] is not None:
+                self._finish(state['sql'], seconds, state['steps'], explain)
+
+    def _finish(self, sql, seconds, steps, explain):
+        """Tally a statement that has finished running."""
+        shape = get_shape(sql)
+        with self.lock:
+            tally = self.shapes.setdefault(shape, [0, 0.0, 0.0, 0])
+            tally[0] += 1
+            tally[1] += seconds
+            tally[2] = max(tally[2], seconds)
+            tally[3] += steps
+            if seconds >= self.slow_seconds:
+                self.slow.append([seconds, sql, explain, None])
+                if len(self.slow) > SLOW_QUERY_COUNT:
+                    self.slow.remove(min(self.slow, key=lambda e: e[0]))
+        if seconds >= self.slow_seconds:
+            self._write('**Slow query (%.1f ms): %s' % (seconds * 1000, sql))
+
+    def get_summary(self):
+        """
+        Return a list of (shape, count, seconds, max_seconds, steps) tuples,
+        one per statement shape, the most time-consuming first.
+        """
+        with self.lock:
+            tallies = [(shape,) + tuple(tally)
+                       for shape, tally in self.shapes.items()]
+        return sorted(tallies, key=lambda tally: tally[2], reverse=True)
+
+    def get_slow_queries(self):
+        """
+        Return a list of (seconds, sql, plan) tuples for the slowest statements
+        kept, the slowest first. The plan is a list of the plan's detail lines.
+        """
+        with self.lock:
+            slow = sorted(self.slow, key=lambda entry: entry[0], reverse=True)
+        for entry in slow:
+            if entry[3] is None:
+                entry[3] = entry[2](entry[1]) if entry[2] else []
+        return [(seconds, sql, plan) for seconds, sql, explain, plan in slow]
+
+    def write_summary(self):
+        """Write the summary and the slow statements to the tracer's file."""
+        elapsed = time.perf_counter() - self.started
+        lines = ['-- query summary after %.1f s --' % (elapsed),
+                 '%8s %10s %10s %12s  %s' % ('count', 'total ms', 'max ms',
+                                             'steps', 'statement')]
+        for shape, count, seconds, longest, steps in self.get_summary():
+            lines.append('%8d %10.1f %10.1f %12d  %s' %
+                         (count, seconds * 1000, longest * 1000, steps, shape))
+        for seconds, sql, plan in self.get_slow_queries():
+            lines.append('-- slow query (%.1f ms): %s' % (seconds * 1000, sql))
+            lines.extend('--   %s' % (detail) for detail in plan)
+        self._write('\n'.join(lines))
+
+    def stop(self):
+        """Stop the periodic summary, and write the final one."""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        atexit.unregister(self.stop)
+        self.write_summary()
+
+    def _summarize(self):
+        """Write a summary every 'summary_seconds', until stopped."""
+        while not self.stopped.wait(self.summary_seconds):
+            self.write_summary()
+
+    def _write(self, text):
+        """Write text to the tracer's file, or else to standard error."""
+        print(text, file=self.file or sys.stderr, flush=True)
+
+def _enable_from_environment():
+    """Enable tracing at startup, if asked to by the environment."""
+    value = os.environ.get(TRACE_ENV, '')
+    if value in ('', '0'):
+        return
+    try:
+        slow_ms = float(value)
+    except ValueError:
+        slow_ms = 1
+    enable_tracing(slow_seconds=slow_ms / 1000 if slow_ms > 1
+                   else SLOW_QUERY_SECONDS)
+
+_enable_from_environment()
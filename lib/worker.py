@@ -0,0 +1,145 @@
+# worker.py v0.1                                                  -*- Python -*-
+
+# Run sqlite database queries on a background thread for a Tk frontend.
+#   Project home: <https://github.com/zero2cx/the-python-mega-course>
+#   Copyright (C) 2017 David Schenck
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import queue
+import sqlite3
+import threading
+from itertools import count
+from .db import Database
+
+POLL_MS = 50
+
+################################################################################
+class QueryWorker():
+    """
+    QueryWorker runs database jobs one at a time on a worker thread, which has
+    its own connection to the database. Each job's result is handed back on the
+    Tk thread, by polling a result queue with the Tk window's after(). A job
+    that is submitted with a key supersedes any earlier job with the same key,
+    which is skipped if still queued, or interrupted if already running.
+    """
+    def __init__(self, window, path, name, on_busy=None):
+        self.window = window
+        self.on_busy = on_busy
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.tickets = count(1)
+        self.latest = {}
+        self.pending = 0
+        self.running = None
+        self.lock = threading.Lock()
+        self.db = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(path, name),
+                                       daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        self.window.after(POLL_MS, self.poll)
+
+    def submit(self, func, *args, key=None, table=None, callback=None,
+               errback=None, **kwargs):
+        """
+        Queue the call func(db, *args, **kwargs) to run on the worker thread,
+        where 'db' is the worker's Database, or its handle on the passed
+        table if another table is named. When the call returns, then
+        callback(result) is called on the Tk thread, or errback(error) if the
+        call raised an sqlite3 error or a ValueError.
+        """
+        ticket = next(self.tickets)
+        with self.lock:
+            if key is not None:
+                self.latest[key] = ticket
+                if self.running and self.running[1] == key:
+                    self.db.conn.interrupt()
+        self._set_pending(1)
+        self.jobs.put((ticket, key, table, func, args, kwargs, callback,
+                       errback))
+        return ticket
+
+    def cancel(self, key):
+        """Supersede any queued or running job with the passed key."""
+        with self.lock:
+            self.latest[key] = None
+            if self.running and self.running[1] == key:
+                self.db.conn.interrupt()
+
+    def poll(self):
+        """
+        Deliver each finished job's result to its callback, then schedule the
+        next poll. Results of superseded jobs are dropped.
+        """
+        while True:
+            try:
+                ticket, key, result, error, callback, errback = \
+                        self.results.get_nowait()
+            except queue.Empty:
+                break
+            self._set_pending(-1)
+            if not self._is_current(ticket, key):
+                continue
+            if error is not None:
+                if errback:
+                    errback(error)
+            elif callback:
+                callback(result)
+        self.window.after(POLL_MS, self.poll)
+
+    def close(self):
+        """Stop the worker thread, once its queued jobs are done."""
+        self.jobs.put(None)
+        self.thread.join()
+
+    def _is_current(self, ticket, key):
+        """Return whether a job has not been superseded."""
+        return key is None or self.latest.get(key) == ticket
+
+    def _set_pending(self, change):
+        """Track the count of unfinished jobs, and report a change between
+        busy and idle to the on_busy callback."""
+        busy = bool(self.pending)
+        self.pending += change
+        if self.on_busy and busy != bool(self.pending):
+            self.on_busy(bool(self.pending))
+
+    def _run(self, path, name):
+        """Run queued jobs against the worker's own Database connection."""
+        self.db = Database(path=path, name=name)
+        self.ready.set()
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            ticket, key, table, func, args, kwargs, callback, errback = job
+            result = error = None
+            with self.lock:
+                current = self._is_current(ticket, key)
+                if current:
+                    self.running = (ticket, key)
+            if current:
+                try:
+                    db = self.db.get_table(table) if table else self.db
+                    result = func(db, *args, **kwargs)
+                except (sqlite3.Error, ValueError) as e:
+                    error = e
+                with self.lock:
+                    self.running = None
+            self.results.put((ticket, key, result, error, callback, errback))
+        """Let the connection be closed and released on its own thread."""
+        self.db.close()
+        self.db = None